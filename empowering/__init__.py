@@ -1,10 +1,38 @@
-try:
-    VERSION = __import__('pkg_resources') \
-        .get_distribution(__name__).version
-except Exception, e:
-    VERSION = 'unknown'
+import sys
+from types import ModuleType
 
-from service import Empowering
-from utils import fix_ssl_verify
+VERSION = '0.15.3'
 
-fix_ssl_verify()
+# Names of the package imported from their module when first used, so
+# `import empowering` doesn't load the whole library
+LAZY_ATTRIBUTES = {
+    'Empowering': 'empowering.service',
+    'AsyncEmpowering': 'empowering.asynchronous',
+    'fix_ssl_verify': 'empowering.utils',
+}
+
+
+class LazyModule(ModuleType):
+    def __getattr__(self, name):
+        module_name = LAZY_ATTRIBUTES.get(name)
+        if module_name is None:
+            raise AttributeError(
+                "'module' object has no attribute '{0}'".format(name)
+            )
+        value = getattr(__import__(module_name, fromlist=[name]), name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(LAZY_ATTRIBUTES))
+
+
+def install_lazy_module():
+    module = sys.modules[__name__]
+    lazy_module = LazyModule(__name__)
+    lazy_module.__dict__.update(module.__dict__)
+    # Python 2 clears the globals of modules which are garbage collected
+    lazy_module._module = module
+    sys.modules[__name__] = lazy_module
+
+install_lazy_module()
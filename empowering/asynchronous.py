@@ -0,0 +1,69 @@
+"""
+empowering.asynchronous
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Non-blocking counterpart of the Empowering service. Every call to a resource
+method is run on a thread pool and returns at once a
+`multiprocessing.pool.AsyncResult`, whose `get()` waits for the response.
+"""
+from multiprocessing.pool import ThreadPool
+
+from empowering.service import Empowering
+
+
+class AsyncResource(object):
+    def __init__(self, pool, resource):
+        self.pool = pool
+        self.resource = resource
+
+    def __getattr__(self, name):
+        method = getattr(self.resource, name)
+        if not callable(method):
+            return method
+
+        def submit(*args, **kwargs):
+            return self.pool.apply_async(method, args, kwargs)
+        submit.__name__ = name
+        submit.__doc__ = method.__doc__
+        return submit
+
+
+class AsyncEmpowering(object):
+    """Empowering service returning AsyncResults instead of responses.
+
+    Takes the arguments of `Empowering` plus the number of `workers` running
+    the requests. The requests go through an `Empowering` client, so they
+    get the same filters and the same re-login on 401.
+
+        emp = AsyncEmpowering(company_id, username, password, workers=32)
+        pending = [emp.ot101_results().pull(201501, contract)
+                   for contract in contracts]
+        results = emp.gather(pending)
+    """
+    def __init__(self, *args, **kwargs):
+        workers = kwargs.pop('workers', 16)
+        self.client = Empowering(*args, **kwargs)
+        self.pool = ThreadPool(workers)
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not getattr(attr, 'is_resource', False):
+            return attr
+
+        def resource(*args, **kwargs):
+            return AsyncResource(self.pool, attr(*args, **kwargs))
+        resource.__name__ = name
+        return resource
+
+    def submit(self, function, *args, **kwargs):
+        return self.pool.apply_async(function, args, kwargs)
+
+    @staticmethod
+    def gather(pending, timeout=None):
+        """Wait for a list of AsyncResults and return their values in order.
+        """
+        return [result.get(timeout) for result in pending]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
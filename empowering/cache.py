@@ -0,0 +1,171 @@
+"""
+empowering.cache
+~~~~~~~~~~~~~~~~
+
+Caches of GET responses revalidated with their ETag or Last-Modified.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from hashlib import sha1
+
+from libsaas import parsers
+
+from empowering.utils import atomic_write
+
+CacheEntry = namedtuple('CacheEntry',
+                        ['etag', 'body', 'stored', 'last_modified'])
+
+
+class MemoryCache(object):
+    """Keep up to `max_entries` responses in memory for `ttl` seconds.
+    """
+    def __init__(self, max_entries=1000, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or time.time() - entry.stored > self.ttl:
+                return None
+            self.entries[key] = entry
+            return entry
+
+    def set(self, key, etag, body, last_modified=None):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = CacheEntry(etag, body, time.time(),
+                                           last_modified)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FileCache(object):
+    """Keep responses in files of `path` for `ttl` seconds.
+
+    When the files take more than `max_bytes` the least recently used ones
+    are removed.
+    """
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.size = sum(size for _, _, size in self.files())
+
+    def filename(self, key):
+        return os.path.join(self.path, sha1(key).hexdigest())
+
+    def files(self):
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            yield filename, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        filename = self.filename(key)
+        # Files are a JSON header line followed by the body
+        try:
+            with open(filename, 'rb') as cache_file:
+                header = json.loads(cache_file.readline())
+                body = cache_file.read()
+        except (IOError, ValueError):
+            return None
+        if time.time() - header['stored'] > self.ttl:
+            self.remove(filename)
+            return None
+        # The modification time tells which files were used last
+        os.utime(filename, None)
+        return CacheEntry(header['etag'], body, header['stored'],
+                          header.get('last_modified'))
+
+    def set(self, key, etag, body, last_modified=None):
+        header = json.dumps({'etag': etag, 'stored': time.time(),
+                             'last_modified': last_modified})
+        filename = self.filename(key)
+        try:
+            # The size of the entry being replaced
+            replaced = os.stat(filename).st_size
+        except OSError:
+            replaced = 0
+        with atomic_write(filename) as entry_file:
+            entry_file.write(header)
+            entry_file.write('\n')
+            entry_file.write(body)
+        with self.lock:
+            # Entries replaced at once may leave it off, evict recounts it
+            self.size += len(header) + len(body) + 1 - replaced
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def evict(self):
+        files = sorted(self.files(), key=lambda f: f[1])
+        self.size = sum(size for _, _, size in files)
+        for filename, _, size in files:
+            if self.size <= self.max_bytes * 0.9:
+                break
+            self.remove(filename)
+            self.size -= size
+
+    def clear(self):
+        with self.lock:
+            for filename, _, _ in self.files():
+                self.remove(filename)
+            self.size = 0
+
+
+def cache_key(request, company_id=''):
+    params = sorted((request.params or {}).items())
+    return json.dumps([company_id, request.uri, params])
+
+
+def cached_request(cache, request, company_id='',
+                   parse_json=parsers.parse_json):
+    """Prepare a GET request to be revalidated against the cache.
+
+    Returns the parser to use with the request, which answers the cached
+    body on 304 and stores the new responses. Responses without an ETag or
+    a Last-Modified (i.e. Eve collections without ETags) can't be
+    revalidated and are not stored.
+    """
+    key = cache_key(request, company_id)
+    entry = cache.get(key)
+    if entry is not None:
+        if entry.etag:
+            request.headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            request.headers['If-Modified-Since'] = entry.last_modified
+
+    def parse(body, code, headers):
+        if code == 304 and entry is not None:
+            return parse_json(entry.body, 200, headers)
+        result = parse_json(body, code, headers)
+        etag = headers.get('etag')
+        if not etag and isinstance(result, dict):
+            etag = result.get('_etag')
+        last_modified = headers.get('last-modified')
+        if etag or last_modified:
+            cache.set(key, etag, body, last_modified)
+        return result
+
+    return parse
@@ -0,0 +1,63 @@
+"""
+empowering.checkpoints
+~~~~~~~~~~~~~~~~~~~~~~
+
+Stores of the last `_updated` pulled for every result type.
+"""
+import fcntl
+import json
+import logging
+import threading
+
+from empowering.utils import atomic_write
+
+logger = logging.getLogger('empowering.checkpoints')
+
+
+class MemoryCheckpointStore(object):
+    def __init__(self):
+        self.checkpoints = {}
+
+    def get(self, key):
+        return self.checkpoints.get(key)
+
+    def set(self, key, value):
+        self.checkpoints[key] = value
+
+
+class FileCheckpointStore(object):
+    """Keep the checkpoints in a JSON file.
+
+    Updates are done under an exclusive lock and the file is replaced in one
+    rename, so it is never left half written and concurrent processes don't
+    lose each other's checkpoints. A file that can't be decoded anyway (i.e.
+    written by other means) is taken as having no checkpoints.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as checkpoints_file:
+                return json.load(checkpoints_file)
+        except IOError:
+            return {}
+        except ValueError:
+            logger.warning('Ignoring the corrupt checkpoints file %s',
+                           self.path)
+            return {}
+
+    def get(self, key):
+        return self.load().get(key)
+
+    def set(self, key, value):
+        with self.lock, open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                checkpoints = self.load()
+                checkpoints[key] = value
+                with atomic_write(self.path) as checkpoints_file:
+                    json.dump(checkpoints, checkpoints_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,131 @@
+"""
+empowering.cli
+~~~~~~~~~~~~~~
+
+Command line tools. The client options default to the EMPOWERING_*
+environment variables, i.e. EMPOWERING_COMPANY_ID or EMPOWERING_PASSWORD.
+"""
+import argparse
+import logging
+import os
+
+logger = logging.getLogger('empowering.cli')
+
+
+def env(name, default=None):
+    return os.environ.get('EMPOWERING_' + name, default)
+
+
+def add_client_arguments(parser):
+    """Add the options to create a client to an argparse parser.
+    """
+    group = parser.add_argument_group('client')
+    group.add_argument('--company-id', default=env('COMPANY_ID'))
+    group.add_argument('--username', default=env('USERNAME'))
+    group.add_argument('--password', default=env('PASSWORD'))
+    group.add_argument('--key-file', default=env('KEY_FILE'))
+    group.add_argument('--cert-file', default=env('CERT_FILE'))
+    group.add_argument('--apiroot', default=env('APIROOT'),
+                       help='Root URL of the API')
+    group.add_argument('--debug', action='store_true',
+                       help='Use the debug API host')
+    group.add_argument('--verify-ssl', action='store_true')
+    group.add_argument('--token-store', default=env('TOKEN_STORE'),
+                       help='File with the auth tokens shared by processes')
+    group.add_argument('--rate-limit', type=float,
+                       help='Requests per second')
+    group.add_argument('--max-concurrency', type=int)
+    group.add_argument('--max-retries', type=int, default=3)
+    group.add_argument('--codec', default='json')
+    group.add_argument('--verbose', '-v', action='store_true')
+    return group
+
+
+def client_from_args(args, **kwargs):
+    """Return a client with the options of `add_client_arguments`.
+    """
+    from empowering.service import Empowering
+    from empowering.tokens import FileTokenStore
+    if not args.company_id:
+        raise SystemExit('A company id is needed, see --company-id')
+    token_store = None
+    if args.token_store:
+        token_store = FileTokenStore(args.token_store)
+    return Empowering(
+        args.company_id, args.username, args.password, args.key_file,
+        args.cert_file, debug=args.debug, apiroot=args.apiroot,
+        token_store=token_store, rate_limit=args.rate_limit,
+        max_retries=args.max_retries, max_concurrency=args.max_concurrency,
+        codec=args.codec, verify_ssl=args.verify_ssl, **kwargs
+    )
+
+
+def setup_logging(args):
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+
+
+def result_name(name):
+    """Normalize a result type given as i.e. ot101, ot101_results or
+    OT101Results to ot101.
+    """
+    from empowering.service import Empowering
+    name = name.lower()
+    if name.endswith('results'):
+        name = name[:-len('results')].rstrip('_')
+    if not hasattr(Empowering, name + '_results'):
+        raise ValueError('Unknown result type {0}'.format(name))
+    return name
+
+
+def result_resource(client, name):
+    """Return the resource of a result type, see `result_name`.
+    """
+    return getattr(client, result_name(name) + '_results')()
+
+
+def export_main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Export results to JSON Lines or CSV files.'
+    )
+    parser.add_argument('result', help='Result type, i.e. ot101')
+    parser.add_argument('path', help='Output file, i.e. ot101.jsonl')
+    parser.add_argument('--period', help='i.e. 201501')
+    parser.add_argument('--contract')
+    parser.add_argument('--format', choices=('jsonl', 'csv'),
+                        help='Taken from the extension of path by default')
+    parser.add_argument('--flat', action='store_true',
+                        help='Flatten nested fields (always done for CSV)')
+    parser.add_argument('--meta', action='store_true',
+                        help='Keep the fields starting with _')
+    parser.add_argument('--max-bytes', type=int,
+                        help='Continue the files in a new part of this size')
+    parser.add_argument('--by-period', action='store_true',
+                        help='Write a file per period')
+    parser.add_argument('--state',
+                        help='Progress file to resume interrupted exports '
+                             '(path.state by default)')
+    parser.add_argument('--no-prefetch', action='store_true')
+    add_client_arguments(parser)
+    args = parser.parse_args(argv)
+    setup_logging(args)
+
+    export_format = args.format
+    if export_format is None:
+        export_format = 'csv' if args.path.endswith('.csv') else 'jsonl'
+    client = client_from_args(args)
+    try:
+        resource = result_resource(client, args.result)
+        state = resource.export(
+            args.path, args.period, args.contract, format=export_format,
+            flat=args.flat, meta=args.meta, max_bytes=args.max_bytes,
+            by_period=args.by_period,
+            state_path=args.state or args.path + '.state',
+            prefetch=not args.no_prefetch
+        )
+    except ValueError, e:
+        parser.error(str(e))
+    logger.info('%d items in %d pages exported to %s', state['items'],
+                state['pages'], ', '.join(state['paths']))
@@ -0,0 +1,175 @@
+"""
+empowering.codec
+~~~~~~~~~~~~~~~~
+
+Pluggable JSON codecs and incremental parsing of `_items`.
+
+Faster JSON libraries (ujson, simplejson) and ijson, to parse responses while
+they stream in, are used when they are installed.
+"""
+import json
+from decimal import Decimal
+
+from libsaas import http
+
+try:
+    from ijson.common import ObjectBuilder
+except ImportError:
+    ObjectBuilder = None
+
+
+def import_ijson():
+    """Return the fastest ijson backend installed, if any.
+    """
+    if ObjectBuilder is None:
+        return None
+    for backend in ('yajl2_c', 'yajl2_cffi', 'yajl2'):
+        try:
+            return __import__('ijson.backends.' + backend,
+                              fromlist=['parse'])
+        except ImportError:
+            continue
+    import ijson
+    return ijson
+
+ijson = import_ijson()
+
+
+class Codec(object):
+    """Encode with `encoder.dumps` and decode with `decoder.loads`.
+    """
+    def __init__(self, name='json', encoder=json, decoder=json):
+        self.name = name
+        self.encoder = encoder
+        self.decoder = decoder
+
+    def __repr__(self):
+        return '<Codec {0}>'.format(self.name)
+
+    def dumps(self, obj):
+        return self.encoder.dumps(obj)
+
+    def loads(self, data):
+        return self.decoder.loads(data)
+
+    def parse_json(self, body, code, headers):
+        """libsaas parser decoding the response with the codec.
+        """
+        if not 200 <= code < 300:
+            raise http.HTTPError(body, code, headers)
+        return self.loads(body)
+
+    def stream_parser(self):
+        """Return a parser giving the response as a `StreamedPage`.
+
+        The executor hands the response file to these parsers instead of the
+        whole body.
+        """
+        def parse(fileobj, code, headers):
+            if not 200 <= code < 300:
+                body = fileobj.read()
+                fileobj.close()
+                raise http.HTTPError(body, code, headers)
+            return StreamedPage(fileobj, self)
+        parse.streaming = True
+        return parse
+
+
+class StreamedPage(object):
+    """The `_items` of a page, parsed one at a time as the body is read.
+
+    The rest of the page (`_links`, `_meta`...) is available in `page` once
+    the items have been iterated. Without ijson the body is read and decoded
+    at once.
+    """
+    def __init__(self, fileobj, codec):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.page = None
+
+    def __iter__(self):
+        try:
+            if ijson is None:
+                self.page = self.codec.loads(self.fileobj.read())
+                items = self.page.pop('_items', [])
+            else:
+                items = self.parse()
+            for item in items:
+                yield item
+        finally:
+            self.fileobj.close()
+
+    def parse(self):
+        rest = ObjectBuilder()
+        item = None
+        for prefix, event, value in ijson.parse(self.fileobj):
+            if isinstance(value, Decimal):
+                value = float(value)
+            if item is not None:
+                item.event(event, value)
+                if prefix == '_items.item' and event in ('end_map',
+                                                         'end_array'):
+                    yield item.value
+                    item = None
+            elif prefix == '_items.item':
+                if event in ('start_map', 'start_array'):
+                    item = ObjectBuilder()
+                    item.event(event, value)
+                else:
+                    yield value
+            else:
+                rest.event(event, value)
+        self.page = rest.value
+
+
+class PreciseUJSON(object):
+    """ujson decoding floats exactly, as json does.
+    """
+    def __init__(self, module):
+        self.module = module
+
+    def loads(self, data):
+        return self.module.loads(data, precise_float=True)
+
+
+def import_module(name):
+    try:
+        module = __import__(name)
+    except ImportError:
+        return None
+    if name == 'ujson':
+        try:
+            module.loads('0.1', precise_float=True)
+        except TypeError:
+            # Newer versions are always precise
+            return module
+        return PreciseUJSON(module)
+    return module
+
+
+def get_codec(name='json'):
+    """Return the codec called name, or name itself if it is a codec.
+
+    'auto' decodes with the fastest library installed (ujson, simplejson or
+    json) and encodes with json, as ujson rounds floats when encoding.
+    'ujson' and 'simplejson' use them in both directions. As they may decode
+    to other types than json (i.e. simplejson gives str for ASCII strings)
+    they are only used when asked for.
+    """
+    if not isinstance(name, basestring):
+        return name
+    if name == 'json':
+        return Codec()
+    if name == 'auto':
+        for decoder_name in ('ujson', 'simplejson'):
+            decoder = import_module(decoder_name)
+            if decoder is not None:
+                return Codec('auto', json, decoder)
+        return Codec('auto')
+    module = import_module(name)
+    if module is None:
+        raise ValueError('JSON library {0} is not installed'.format(name))
+    return Codec(name, __import__(name), module)
+
+
+default_codec = Codec()
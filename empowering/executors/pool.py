@@ -0,0 +1,176 @@
+import httplib
+import logging
+import socket
+import threading
+import time
+from collections import deque
+
+from empowering import metrics
+from empowering.executors.throttle import IDEMPOTENT_METHODS
+
+logger = logging.getLogger('empowering.executors.pool')
+
+
+class InstrumentedHTTPSConnection(httplib.HTTPSConnection):
+    """HTTPS connection adding its DNS, connect and TLS times to the metrics
+    of the request being made, if any.
+    """
+    def connect(self):
+        if metrics.current() is None or self._tunnel_host:
+            return httplib.HTTPSConnection.connect(self)
+        start = time.time()
+        addresses = socket.getaddrinfo(self.host, self.port, 0,
+                                       socket.SOCK_STREAM)
+        resolved = time.time()
+        error = None
+        for address in addresses:
+            try:
+                sock = socket.create_connection(
+                    address[4][:2], self.timeout, self.source_address
+                )
+                break
+            except socket.error, error:
+                continue
+        else:
+            raise error
+        connected = time.time()
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+        metrics.update(dns=resolved - start, connect=connected - resolved,
+                       tls=time.time() - connected)
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of persistent HTTP/1.1 connections.
+
+    Connections are kept per (host, key_file, cert_file, context) key. At most
+    `max_per_host` idle connections are kept for every key and connections
+    idle for more than `idle_timeout` seconds are evicted.
+    """
+    def __init__(self, max_per_host=10, idle_timeout=60,
+                 connection_class=InstrumentedHTTPSConnection):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.connection_class = connection_class
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, host, key_file=None, cert_file=None, timeout=None,
+            context=None):
+        """Return a tuple (connection, reused) for the given key.
+
+        With an SSL `context` the client certificate is taken from it.
+        """
+        key = (host, key_file, cert_file, context)
+        now = time.time()
+        with self.lock:
+            conns = self.idle.get(key)
+            while conns:
+                conn, last_used = conns.pop()
+                if now - last_used <= self.idle_timeout and conn.sock:
+                    logger.debug('reusing connection to %s', host)
+                    return conn, True
+                conn.close()
+        logger.debug('opening connection to %s', host)
+        if context is None:
+            conn = self.connection_class(host, key_file=key_file,
+                                         cert_file=cert_file, timeout=timeout)
+        else:
+            conn = self.connection_class(host, timeout=timeout,
+                                         context=context)
+        conn.pool_key = key
+        return conn, False
+
+    def put(self, conn):
+        """Give back a connection whose response has been fully read.
+        """
+        if conn.sock is None:
+            return
+        now = time.time()
+        with self.lock:
+            conns = self.idle.setdefault(conn.pool_key, deque())
+            self._evict(conns, now)
+            if len(conns) < self.max_per_host:
+                conns.append((conn, now))
+                return
+        conn.close()
+
+    def _evict(self, conns, now):
+        while conns and now - conns[0][1] > self.idle_timeout:
+            conn, _ = conns.popleft()
+            conn.close()
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                conn.close()
+
+
+class PooledResponse(object):
+    """Wraps a httplib.HTTPResponse and gives its connection back to the pool
+    once the body has been completely read.
+    """
+    def __init__(self, pool, conn, response):
+        self.pool = pool
+        self.conn = conn
+        self.response = response
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        if self.response.isclosed():
+            self.release()
+        return data
+
+    recv = read
+
+    def release(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            self.pool.put(conn)
+
+    def close(self):
+        complete = self.response.isclosed()
+        self.response.close()
+        conn, self.conn = self.conn, None
+        if conn is None:
+            return
+        if complete:
+            self.pool.put(conn)
+        else:
+            # Unread data is left in the socket, it can not be reused
+            conn.close()
+
+
+def send_request(pool, host, key_file, cert_file, timeout, method, selector,
+                 data, headers, context=None):
+    """Send a request over a pooled connection.
+
+    A reused connection may have been closed by the server while it was
+    idle. In that case the request is retried once over a new connection if
+    it failed while being sent or, once it was sent, if its method is
+    idempotent, as the server may have applied it.
+    """
+    while True:
+        conn, reused = pool.get(host, key_file, cert_file, timeout, context)
+        if conn.sock is None:
+            conn.connect()
+        sent = False
+        try:
+            start = time.time()
+            conn.request(method, selector, data, headers)
+            sent = True
+            response = conn.getresponse(buffering=True)
+        except (socket.error, httplib.BadStatusLine,
+                httplib.CannotSendRequest):
+            conn.close()
+            if reused and (not sent or
+                           method.upper() in IDEMPOTENT_METHODS):
+                logger.debug('stale connection to %s, retrying', host)
+                continue
+            raise
+        metrics.update(ttfb=time.time() - start, reused=reused)
+        return conn, response
+
+
+default_pool = ConnectionPool()
@@ -0,0 +1,192 @@
+"""
+empowering.executors.throttle
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Client side rate limiting, retries and adaptive concurrency.
+"""
+import calendar
+import logging
+import random
+import socket
+import threading
+import time
+import urllib2
+from email.utils import parsedate
+
+from libsaas import http
+
+from empowering import metrics
+
+logger = logging.getLogger('empowering.executors.throttle')
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+class TokenBucket(object):
+    """Allow `rate` requests per second, with bursts of up to `burst`.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(object):
+    """Limit the requests in flight, adapting the limit to the API.
+
+    The limit grows by one for every `limit` successful requests and is
+    halved when a request fails or takes longer than `latency_target`
+    seconds, without going out of `min_concurrency`..`max_concurrency`.
+    """
+    def __init__(self, max_concurrency, min_concurrency=1,
+                 latency_target=None):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, failed=False):
+        with self.condition:
+            self.in_flight -= 1
+            slow = self.latency_target and latency > self.latency_target
+            if failed or slow:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                logger.debug('Concurrency decreased to %d', self.limit)
+            else:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RetryPolicy(object):
+    """Retry throttled and failed requests with exponential backoff.
+
+    429 responses are always retried, other `statuses` and connection errors
+    only for idempotent methods. The wait is a random time up to
+    `backoff * 2 ** attempt` seconds (full jitter), or the `Retry-After` of
+    the response when it says so.
+    """
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=60,
+                 statuses=RETRY_STATUSES, methods=IDEMPOTENT_METHODS):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+        self.methods = methods
+
+    def should_retry(self, method, code):
+        if code == 429:
+            return True
+        if method.upper() not in self.methods:
+            return False
+        return code is None or code in self.statuses
+
+    def delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.max_backoff, retry_after)
+        return random.uniform(
+            0, min(self.max_backoff, self.backoff * 2 ** attempt)
+        )
+
+
+def retry_after(headers):
+    """Seconds to wait from a `Retry-After` header, if any.
+    """
+    value = headers and headers.get('Retry-After', headers.get('retry-after'))
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        date = parsedate(value)
+        if date is None:
+            return None
+        return max(0, calendar.timegm(date) - time.time())
+
+
+def error_details(error):
+    """Return the status code and the headers of a failed request.
+    """
+    if isinstance(error, urllib2.HTTPError):
+        return error.code, error.info()
+    if isinstance(error, http.HTTPError):
+        return error.code, error.headers
+    return None, None
+
+
+class ThrottledExecutor(object):
+    """Wrap an executor with a rate limiter, a concurrency limiter and a
+    retry policy, all optional.
+    """
+    def __init__(self, executor, bucket=None, limiter=None, retry=None):
+        self.executor = executor
+        self.bucket = bucket
+        self.limiter = limiter
+        self.retry = retry
+
+    def __call__(self, request, parser):
+        attempt = 0
+        while True:
+            try:
+                return self.execute(request, parser)
+            except (urllib2.HTTPError, http.HTTPError, urllib2.URLError,
+                    socket.error), error:
+                code, headers = error_details(error)
+                retry = self.retry
+                if (retry is None or attempt >= retry.max_retries or
+                        not retry.should_retry(request.method, code)):
+                    raise
+                if isinstance(error, urllib2.HTTPError) and error.fp:
+                    # Drain the body so the connection goes back to the pool
+                    error.read()
+                    error.close()
+                delay = retry.delay(attempt, retry_after(headers))
+                logger.info('Request to %s failed (%s), retrying in %.2fs',
+                            request.uri, code or error, delay)
+                time.sleep(delay)
+                metrics.count_retry()
+                attempt += 1
+
+    def execute(self, request, parser):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        if self.limiter is None:
+            return self.executor(request, parser)
+        self.limiter.acquire()
+        start = time.time()
+        failed = True
+        try:
+            result = self.executor(request, parser)
+            failed = False
+            return result
+        except (urllib2.HTTPError, http.HTTPError), error:
+            # Only the errors telling the API is overloaded count
+            failed = error.code in RETRY_STATUSES
+            raise
+        finally:
+            self.limiter.release(time.time() - start, failed)
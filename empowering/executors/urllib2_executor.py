@@ -1,41 +1,104 @@
-import urllib2
 import httplib
+import urllib2
 import logging
 import json
+import socket
+import ssl
+import threading
+import time
 from urlparse import urlparse, urlunparse
+from libsaas import http
 from libsaas.executors import base, urllib2_executor
+from empowering import metrics
+from empowering.utils import gzip_compress, GzipReader
+from empowering.executors.pool import default_pool, send_request, \
+    PooledResponse
 
 logger = logging.getLogger('empowering.executors.urllib2_executor')
 
 API_HOST = 'api.beedataanalytics.com'
 DEBUG_API_HOST = '91.121.140.152'
 
+ssl_contexts = {}
+ssl_contexts_lock = threading.Lock()
+
+
+def ssl_context(verify=False, key_file=None, cert_file=None):
+    """Return the SSL context shared by the connections with these settings.
+
+    Contexts are only used for the client, the global default context is
+    left alone.
+    """
+    key = (verify, key_file, cert_file)
+    with ssl_contexts_lock:
+        if key not in ssl_contexts:
+            if verify:
+                context = ssl.create_default_context()
+            else:
+                context = ssl._create_unverified_context()
+            if key_file and cert_file:
+                context.load_cert_chain(cert_file, key_file)
+            ssl_contexts[key] = context
+        return ssl_contexts[key]
+
 
 class HTTPSClientAuthHandler(urllib2.HTTPSHandler):
     """HTTPS Client Auth Handler.
 
+    Connections are taken from a pool of persistent connections so the TCP
+    and TLS handshakes are only paid once per connection.
+
     (c) Kalys Osmonov - http://www.osmonov.com/2009/04/client-certificates-with-urllib2.html
     """
-    def __init__(self, key_file, cert_file):
+    def __init__(self, key_file, cert_file, pool=None, verify=False):
         urllib2.HTTPSHandler.__init__(self)
         self.key_file = key_file
         self.cert_file = cert_file
+        self.pool = pool or default_pool
+        self.verify = verify
 
     def https_open(self, req):
-        # Rather than pass in a reference to a connection class, we pass in
-        # a reference to a function which, for all intents and purposes,
-        # will behave as a constructor
-        return self.do_open(self.getConnection, req)
-
-    def getConnection(self, host, timeout=300):
-        if host not in (API_HOST, DEBUG_API_HOST):
-            res = httplib.HTTPSConnection(host)
-            return res
-        logger.debug('using https connection (key file:{} Cert file:{})'.format(
-            self.key_file, self.cert_file
-        ))
-        return httplib.HTTPSConnection(host, key_file=self.key_file,
-                                       cert_file=self.cert_file)
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        # Through a proxy host is the proxy and the API host is tunneled to
+        if (req._tunnel_host or host) not in (API_HOST, DEBUG_API_HOST):
+            key_file = cert_file = None
+        else:
+            key_file, cert_file = self.key_file, self.cert_file
+            logger.debug(
+                'using https connection (key file:{} Cert file:{})'.format(
+                    key_file, cert_file
+            ))
+
+        context = ssl_context(self.verify, key_file, cert_file)
+        if req._tunnel_host:
+            # do_open sets up the CONNECT tunnel, without pooling
+            return self.do_open(httplib.HTTPSConnection, req,
+                                context=context)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+
+        try:
+            conn, r = send_request(
+                self.pool, host, key_file, cert_file, req.timeout,
+                req.get_method(), req.get_selector(), req.data, headers,
+                context
+            )
+        except socket.error, err:
+            raise urllib2.URLError(err)
+
+        fp = socket._fileobject(PooledResponse(self.pool, conn, r),
+                                close=True)
+        resp = urllib2.addinfourl(fp, r.msg, req.get_full_url())
+        resp.code = r.status
+        resp.msg = r.reason
+        return resp
 
 
 class HTTPEmpoweringFilterHandler(urllib2.BaseHandler):
@@ -57,6 +120,11 @@ class HTTPEmpoweringFilterHandler(urllib2.BaseHandler):
                 request.unverifiable
             )
             newr.timeout = request.timeout
+            # Headers added by the handlers before, i.e. Accept-Encoding
+            for name, value in request.unredirected_hdrs.items():
+                newr.add_unredirected_header(name, value)
+            # Auth retries are counted on the request
+            newr.auth_retried = getattr(request, 'auth_retried', 0)
             newr.set_method(request.get_method())
             return newr
         else:
@@ -64,51 +132,180 @@ class HTTPEmpoweringFilterHandler(urllib2.BaseHandler):
     https_request = http_request
 
 
+class HTTPNotModifiedHandler(urllib2.BaseHandler):
+    """Give 304 responses back to the executor instead of raising them, so
+    the cached result can be used.
+    """
+    def http_error_304(self, req, fp, code, msg, headers):
+        return fp
+
+
+class HTTPGzipHandler(urllib2.BaseHandler):
+    """Ask for gzipped responses, decompressing them as they are read, and
+    gzip the request bodies of `threshold` bytes or more.
+    """
+    # Before the handlers setting the Content-Length of the body
+    handler_order = 400
+
+    def __init__(self, threshold=None, level=6):
+        self.threshold = threshold
+        self.level = level
+
+    def http_request(self, req):
+        if not req.has_header('Accept-encoding'):
+            req.add_unredirected_header('Accept-Encoding', 'gzip')
+        data = req.get_data()
+        if (self.threshold is not None and data and
+                len(data) >= self.threshold and
+                not req.has_header('Content-encoding')):
+            data = gzip_compress(data, self.level)
+            req.add_data(data)
+            req.add_header('Content-Encoding', 'gzip')
+            req.add_unredirected_header('Content-Length', str(len(data)))
+            metrics.update(bytes_sent=len(data))
+        return req
+
+    def http_response(self, req, response):
+        headers = response.info()
+        encoding = headers.get('Content-Encoding', '').lower()
+        if encoding not in ('gzip', 'x-gzip'):
+            return response
+        del headers['Content-Encoding']
+        if 'Content-Length' in headers:
+            del headers['Content-Length']
+        decompressed = urllib2.addinfourl(
+            GzipReader(response), headers, response.geturl(), response.code
+        )
+        decompressed.msg = response.msg
+        return decompressed
+
+    https_request = http_request
+    https_response = http_response
+
+
 class HTTPAuthEmpowering(urllib2.BaseHandler):
 
-    def __init__(self, username, password, endpoint):
+    def __init__(self, username, password, endpoint, token_store=None,
+                 context=None):
         self.username = username
         self.password = password
         self.token = None
         self.endpoint = endpoint
-        self.retried = 0
         self.max_retries = 1
+        # i.e. empowering.tokens.FileTokenStore
+        self.token_store = token_store
+        self.last_check = 0
+        self.context = context
 
     def http_error_401(self, req, fp, code, msg, headers):
         logger.debug("Login required. Retry auth")
-        response = self.retry_auth(req, headers)
-        self.reset_retry_count()
-        return response
+        # Drain the body so the connection goes back to the pool
+        fp.read()
+        fp.close()
+        return self.retry_auth(req, headers)
+
+    @property
+    def store_key(self):
+        return '{0}|{1}'.format(self.endpoint, self.username)
 
-    def login(self):
+    def login(self, stale_token=None):
+        if self.token_store is None:
+            return self.request_login()
+        auth = self.token_store.fetch(self.store_key, self.request_login,
+                                      stale_token=stale_token)
+        self.token = auth['token']
+        return auth
+
+    def current_token(self):
+        """Return the token to use, taking the ones renewed by other
+        processes from the token store and refreshing it before it expires.
+        """
+        store = self.token_store
+        if store is None or not self.token:
+            return self.token
+        now = time.time()
+        if now - self.last_check >= store.check_interval:
+            self.last_check = now
+            auth = store.get(self.store_key)
+            if auth is None:
+                auth = self.login()
+            elif store.needs_refresh(auth):
+                store.refresh_in_background(self.store_key,
+                                            self.request_login)
+            self.token = auth['token']
+        return self.token
+
+    def request_login(self):
         data = json.dumps({
             "username": self.username, "password": self.password
         })
         req = urllib2.Request(self.endpoint, data)
         req.headers['Content-Type'] = 'application/json'
-        response = urllib2.urlopen(req)
+        response = urllib2.urlopen(req, context=self.context)
         auth = json.loads(response.read())
         self.token = auth['token']
         response.close()
         return auth
 
-    def reset_retry_count(self):
-        self.retried = 0
-
     def retry_auth(self, req, headers):
-        if self.retried >= self.max_retries:
-            return urllib2.HTTPError(
+        # Counted per request, as the handler is shared between threads
+        retried = getattr(req, 'auth_retried', 0)
+        if retried >= self.max_retries:
+            raise urllib2.HTTPError(
                 req.get_full_url(), 401, "Auth failed", headers, None
             )
-        auth = self.login()
-        self.reset_retry_count()
+        req.auth_retried = retried + 1
+        metrics.count_retry()
+        auth = self.login(stale_token=self.token)
         req.headers['Cookie'] = "iPlanetDirectoryPro={}".format(auth['token'])
         return self.parent.open(req, timeout=req.timeout)
 
 
 class Urllib2Executor(urllib2_executor.Urllib2Executor):
+    """Executor with its own opener, so every client keeps its handlers.
+    """
     def __init__(self, extra_handlers):
         self.handlers = extra_handlers
+        self.opener = urllib2.build_opener(*extra_handlers)
+
+    def __call__(self, request, parser):
+        logger.debug('requesting %r', request)
+
+        uri = request.uri
+        data = None
+        if request.method.upper() in http.URLENCODE_METHODS:
+            uri = urllib2_executor.encode_uri(request)
+        else:
+            data = urllib2_executor.encode_data(request)
+
+        req = urllib2_executor.RequestWithMethod(uri, data, request.headers)
+        req.set_method(request.method)
+        resp = self.opener.open(req)
+        if getattr(parser, 'streaming', False):
+            # The parser reads the body itself, as it arrives
+            return parser(resp, resp.code, dict(resp.info()))
+        body = resp.read()
+        headers = dict(resp.info())
+        logger.debug('response code: %r, headers: %r', resp.code, headers)
+        return parser(body, resp.code, headers)
+
+
+def dispatch(request, parser):
+    """Process-wide executor running each request with the executor of the
+    client that made it.
+    """
+    executor = getattr(request, 'executor', None)
+    if executor is None:
+        executor = default_executor
+    return executor(request, parser)
+
+
+default_executor = urllib2_executor.Urllib2Executor(())
+
+
+def install_dispatcher():
+    if base.current_executor() is not dispatch:
+        base.use_executor(dispatch)
 
 
 def use(extra_handlers=()):
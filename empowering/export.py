@@ -0,0 +1,257 @@
+"""
+empowering.export
+~~~~~~~~~~~~~~~~~
+
+Export results to JSON Lines or CSV files as the pages arrive, so the
+results are never held in memory at once.
+
+The files can be split by period and rotated in parts when they reach a
+size. The progress of an export is kept in a state file after every page,
+so an interrupted export is resumed from the last page written.
+"""
+import csv
+import json
+import logging
+import os
+
+from empowering.resource import next_page
+from empowering.utils import atomic_write, flatten
+
+logger = logging.getLogger('empowering.export')
+
+
+def encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class JSONLinesWriter(object):
+    extension = '.jsonl'
+
+    def __init__(self, fileobj, fields=None, dumps=json.dumps):
+        self.fileobj = fileobj
+        self.fields = None
+        self.dumps = dumps
+
+    def accepts(self, fields):
+        return True
+
+    def write(self, item):
+        self.fileobj.write(encode(self.dumps(item)))
+        self.fileobj.write('\n')
+
+
+class CSVWriter(object):
+    """Write items as rows with the columns `fields`, and a header in new
+    files. Lists and dicts are written as JSON.
+    """
+    extension = '.csv'
+
+    def __init__(self, fileobj, fields, dumps=json.dumps):
+        self.fileobj = fileobj
+        self.fields = list(fields)
+        self.known = set(self.fields)
+        self.dumps = dumps
+        self.writer = csv.writer(fileobj)
+        if not fileobj.tell():
+            self.writer.writerow([encode(field) for field in self.fields])
+
+    def accepts(self, fields):
+        return self.known.issuperset(fields)
+
+    def value(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, (list, dict)):
+            return encode(self.dumps(value))
+        if isinstance(value, float):
+            return repr(value)
+        return encode(value)
+
+    def write(self, item):
+        self.writer.writerow([self.value(item.get(field))
+                              for field in self.fields])
+
+WRITERS = {
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+}
+
+
+class ExportFiles(object):
+    """The files written by an export.
+
+    Items are written to `path`, or to a file per period key
+    (`<name>-<key><ext>`), which is continued in a new part
+    (`<name>.<part><ext>`) once it reaches `max_bytes` or, for CSV, when the
+    items have fields missing from its header. `files` is the state of the
+    files being written, as returned by `sync`, and `paths` the list of all
+    the files created, which is extended as they are.
+    """
+    def __init__(self, path, writer_class, dumps=json.dumps, max_bytes=None,
+                 files=None, paths=None):
+        self.name, self.extension = os.path.splitext(path)
+        self.extension = self.extension or writer_class.extension
+        self.writer_class = writer_class
+        self.dumps = dumps
+        self.max_bytes = max_bytes
+        self.files = files or {}
+        self.resumed = set(self.files)
+        self.paths = paths if paths is not None else []
+        self.writers = {}
+
+    def file_path(self, key, part):
+        path = self.name
+        if key:
+            path += '-{0}'.format(key)
+        if part:
+            path += '.{0}'.format(part)
+        return path + self.extension
+
+    def open_writer(self, key, fields):
+        state = self.files.get(key)
+        if key in self.resumed:
+            # Drop what was written after the last sync
+            self.resumed.discard(key)
+            fileobj = open(state['path'], 'r+b')
+            fileobj.truncate(state['size'])
+            fileobj.seek(0, os.SEEK_END)
+            fields = state['fields']
+        else:
+            part = 0
+            if state is not None:
+                part = state['part'] + 1
+                if state['fields']:
+                    new = sorted(set(fields) - set(state['fields']))
+                    fields = state['fields'] + new
+            state = self.files[key] = {'path': self.file_path(key, part),
+                                       'part': part, 'size': 0}
+            fileobj = open(state['path'], 'wb')
+            if state['path'] not in self.paths:
+                self.paths.append(state['path'])
+        writer = self.writer_class(fileobj, fields, self.dumps)
+        self.writers[key] = writer
+        state['fields'] = writer.fields
+        return writer
+
+    def close_writer(self, key):
+        writer = self.writers.pop(key)
+        writer.fileobj.close()
+
+    def full(self, writer):
+        return self.max_bytes and writer.fileobj.tell() >= self.max_bytes
+
+    def write(self, key, items):
+        """Write items to the file of key.
+        """
+        fields = set()
+        for item in items:
+            fields.update(item)
+        fields = sorted(fields)
+        writer = self.writers.get(key)
+        if writer is None:
+            writer = self.open_writer(key, fields)
+        if not writer.accepts(fields):
+            self.close_writer(key)
+            writer = self.open_writer(key, fields)
+        for item in items:
+            if self.full(writer):
+                self.close_writer(key)
+                writer = self.open_writer(key, fields)
+            writer.write(item)
+
+    def sync(self):
+        """Flush the files to disk and return their state.
+        """
+        for key, writer in self.writers.items():
+            writer.fileobj.flush()
+            os.fsync(writer.fileobj.fileno())
+            self.files[key]['size'] = writer.fileobj.tell()
+        return self.files
+
+    def close(self):
+        for key in self.writers.keys():
+            self.close_writer(key)
+
+
+def load_state(path):
+    try:
+        with open(path, 'rb') as state_file:
+            return json.load(state_file)
+    except IOError:
+        return None
+
+
+def save_state(path, state):
+    with atomic_write(path) as state_file:
+        json.dump(state, state_file)
+
+
+def export_results(resource, path, format='jsonl', where=None, sort=None,
+                   max_results=None, flat=None, meta=False, max_bytes=None,
+                   by_period=False, state_path=None, prefetch=True):
+    """Export the results of a query of `resource` to `path`.
+
+    :param format: 'jsonl' or 'csv'.
+    :param flat: Flatten nested fields (see `empowering.utils.flatten`),
+        always done for CSV.
+    :param meta: Keep the fields starting with '_' (`_id`, `_etag`...).
+    :param max_bytes: Continue the files in a new part when they reach it.
+    :param by_period: Write a file per value of the period field.
+    :param state_path: File keeping the progress. When it exists the export
+        is resumed from the page after the last one written.
+
+    Returns the state of the export, with the `items` and `pages` written
+    and the `paths` of the files.
+    """
+    writer_class = WRITERS[format]
+    if format == 'csv':
+        flat = True
+    query = [resource.path, where, sort, max_results, format]
+    state = {'query': query, 'page': None, 'done': False, 'items': 0,
+             'pages': 0, 'files': {}, 'paths': []}
+    saved = state_path and load_state(state_path)
+    if saved:
+        if saved['query'] != query:
+            raise ValueError(
+                'The state file {0} is of another export'.format(state_path)
+            )
+        state = saved
+        logger.info('Resuming the export to %s from page %s', path,
+                    state['page'])
+    if state['done']:
+        return state
+
+    files = ExportFiles(path, writer_class, resource.codec.dumps, max_bytes,
+                        state['files'], state['paths'])
+    period_field = getattr(resource, 'period_field', None)
+    try:
+        for result in resource.iter_pages(where, sort, max_results,
+                                          prefetch, page=state['page']):
+            groups = {}
+            items = result.get('_items', [])
+            for item in items:
+                if flat:
+                    item = flatten(item)
+                if not meta:
+                    item = dict((key, value) for key, value in item.iteritems()
+                                if not key.startswith('_'))
+                key = ''
+                if by_period:
+                    key = '{0}'.format(item.get(period_field, ''))
+                groups.setdefault(key, []).append(item)
+            for key, group in sorted(groups.items()):
+                files.write(key, group)
+            state['files'] = files.sync()
+            state['items'] += len(items)
+            state['pages'] += 1
+            state['page'] = next_page(result)
+            state['done'] = not state['page']
+            if state_path:
+                save_state(state_path, state)
+            logger.debug('Exported page %d of %s, %d items', state['pages'],
+                         resource.path, state['items'])
+    finally:
+        files.close()
+    return state
@@ -0,0 +1,202 @@
+"""
+empowering.frames
+~~~~~~~~~~~~~~~~~
+
+Columnar frames of results: one array per (flattened) field instead of one
+dict per item.
+
+Numeric columns are numpy arrays when numpy is installed and `array.array`
+otherwise. Other columns are lists, with their strings shared between the
+rows that repeat them (i.e. the contractId of every day of a month).
+"""
+from array import array
+
+from empowering.utils import flatten
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+AGGREGATES = ('sum', 'mean', 'count', 'min', 'max')
+
+
+def column_type(values):
+    """Return 'int', 'float' or 'object' for a list of values.
+    """
+    kind = 'int'
+    for value in values:
+        if value is None:
+            kind = 'float'
+        elif isinstance(value, bool) or not isinstance(value,
+                                                      (int, long, float)):
+            return 'object'
+        elif isinstance(value, float):
+            kind = 'float'
+    return kind
+
+
+def make_column(values):
+    kind = column_type(values)
+    if kind == 'float':
+        values = [float('nan') if v is None else v for v in values]
+    if kind == 'object':
+        return values
+    if numpy is not None:
+        return numpy.array(values, dtype='int64' if kind == 'int'
+                           else 'float64')
+    return array('l' if kind == 'int' else 'd', values)
+
+
+class ResultFrame(object):
+    """Results as columns, indexed by `index` fields (contractId and period).
+
+        frame = client.ot503_results().pull_frame(201501)
+        frame['consumption']
+        frame.get('contract-1', 20150101)
+        frame.aggregate('consumption', by='contractId')
+    """
+    def __init__(self, columns, index=('contractId',)):
+        self.columns = columns
+        self.index = tuple(index)
+        self.length = len(columns.values()[0]) if columns else 0
+        self._positions = None
+
+    @classmethod
+    def from_items(cls, items, index=('contractId',), meta=False):
+        """Build a frame from an iterable of items, i.e. `iter_pull`.
+
+        Fields starting with '_' (`_id`, `_etag`, `_links`...) are skipped
+        unless `meta` is set.
+        """
+        values = {}
+        strings = {}
+        length = 0
+        for item in items:
+            for key, value in flatten(item).iteritems():
+                if not meta and key.startswith('_'):
+                    continue
+                if isinstance(value, basestring):
+                    value = strings.setdefault(value, value)
+                column = values.get(key)
+                if column is None:
+                    column = values[key] = [None] * length
+                column.append(value)
+            length += 1
+            for column in values.itervalues():
+                if len(column) < length:
+                    column.append(None)
+        columns = dict((key, make_column(column))
+                       for key, column in values.iteritems())
+        return cls(columns, index)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    @property
+    def fields(self):
+        return sorted(self.columns)
+
+    @property
+    def nbytes(self):
+        """Memory used by the numeric columns.
+        """
+        total = 0
+        for column in self.columns.itervalues():
+            if hasattr(column, 'nbytes'):
+                total += column.nbytes
+            elif isinstance(column, array):
+                total += column.itemsize * len(column)
+        return total
+
+    def index_key(self, position):
+        key = tuple(self.columns[field][position] for field in self.index
+                    if field in self.columns)
+        return key[0] if len(key) == 1 else key
+
+    @property
+    def positions(self):
+        """Dict from the index values of every row to its position.
+        """
+        if self._positions is None:
+            self._positions = dict(
+                (self.index_key(position), position)
+                for position in xrange(self.length)
+            )
+        return self._positions
+
+    def row(self, position):
+        return dict((field, column[position])
+                    for field, column in self.columns.iteritems())
+
+    def get(self, *key):
+        """Return the row of the given index values, or None.
+        """
+        position = self.positions.get(key[0] if len(key) == 1 else key)
+        if position is None:
+            return None
+        return self.row(position)
+
+    def aggregate(self, field, by='contractId', func='sum'):
+        """Aggregate a numeric field by the values of another one.
+
+        Returns a dict from the values of `by` to the `func` (sum, mean,
+        count, min or max) of `field`. Missing values are ignored.
+        """
+        if func not in AGGREGATES:
+            raise ValueError('Unknown aggregate {0}'.format(func))
+        groups = {}
+        codes = [groups.setdefault(value, len(groups))
+                 for value in self.columns[by]]
+        keys = sorted(groups, key=groups.get)
+        values = self.columns[field]
+        if numpy is not None:
+            result = numpy_aggregate(numpy.asarray(values, dtype='float64'),
+                                     numpy.array(codes), len(keys), func)
+        else:
+            result = python_aggregate(values, codes, len(keys), func)
+        return dict(zip(keys, result))
+
+
+def numpy_aggregate(values, codes, size, func):
+    present = ~numpy.isnan(values)
+    values, codes = values[present], codes[present]
+    counts = numpy.bincount(codes, minlength=size)
+    if func == 'count':
+        return counts.tolist()
+    if func in ('sum', 'mean'):
+        sums = numpy.bincount(codes, weights=values, minlength=size)
+        if func == 'sum':
+            return sums.tolist()
+        with numpy.errstate(invalid='ignore'):
+            return (sums / counts).tolist()
+    initial = numpy.inf if func == 'min' else -numpy.inf
+    result = numpy.full(size, initial)
+    getattr(numpy, 'minimum' if func == 'min' else 'maximum').at(
+        result, codes, values
+    )
+    result[counts == 0] = numpy.nan
+    return result.tolist()
+
+
+def python_aggregate(values, codes, size, func):
+    groups = [[] for _ in xrange(size)]
+    for code, value in zip(codes, values):
+        if value == value and value is not None:
+            groups[code].append(value)
+    nan = float('nan')
+    if func == 'count':
+        return [len(group) for group in groups]
+    if func == 'sum':
+        return [float(sum(group)) for group in groups]
+    if func == 'mean':
+        return [float(sum(group)) / len(group) if group else nan
+                for group in groups]
+    select = min if func == 'min' else max
+    return [float(select(group)) if group else nan for group in groups]
@@ -0,0 +1,154 @@
+import json
+import logging
+import threading
+import time
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+from libsaas import http
+
+from empowering.utils import gzip_compress
+
+logger = logging.getLogger('empowering.ingest')
+
+
+class IngestStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.end = None
+        self.measures = 0
+        self.measurements = 0
+        self.batches = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.failures = []
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def measures_per_second(self):
+        return self.measures / (self.elapsed or 1)
+
+    @property
+    def bytes_per_second(self):
+        return self.sent_bytes / (self.elapsed or 1)
+
+    def add_batch(self, batch, sent_bytes, error=None):
+        with self.lock:
+            self.batches += 1
+            self.sent_bytes += sent_bytes
+            if error is not None:
+                self.failures.append((batch.measures, error))
+                return
+            self.measures += len(batch.measures)
+            self.measurements += batch.measurements
+            self.raw_bytes += batch.size
+
+    def __repr__(self):
+        return ('<IngestStats measures={0} batches={1} failures={2} '
+                '{3:.1f} measures/s {4:.1f} bytes/s>'.format(
+                    self.measures, self.batches, len(self.failures),
+                    self.measures_per_second, self.bytes_per_second))
+
+
+class Batch(object):
+    def __init__(self):
+        self.measures = []
+        self.serialized = []
+        self.measurements = 0
+        self.size = 2
+
+    def add(self, measure, serialized, measurements):
+        self.measures.append(measure)
+        self.serialized.append(serialized)
+        self.measurements += measurements
+        self.size += len(serialized) + 1
+
+    def fits(self, serialized, measurements, max_bytes, max_measurements):
+        if not self.measures:
+            return True
+        return (self.size + len(serialized) + 1 <= max_bytes and
+                self.measurements + measurements <= max_measurements)
+
+    def payload(self):
+        return '[' + ','.join(self.serialized) + ']'
+
+
+class AmonMeasuresIngestor(object):
+    """Upload a stream of AMON measures in batches.
+
+    Measures are serialized once and grouped in batches of at most
+    `max_bytes` serialized bytes and `max_measurements` measurements. Up to
+    `workers` batches are uploaded concurrently, gzipped when `compress` is
+    set.
+    """
+    def __init__(self, resource, max_bytes=1024 * 1024,
+                 max_measurements=10000, workers=4, compress=True,
+                 serialize=json.dumps):
+        self.resource = resource
+        self.max_bytes = max_bytes
+        self.max_measurements = max_measurements
+        self.workers = workers
+        self.compress = compress
+        self.serialize = serialize
+
+    def batches(self, measures):
+        batch = Batch()
+        for measure in measures:
+            serialized = self.serialize(measure)
+            measurements = len(measure.get('measurements') or ())
+            if not batch.fits(serialized, measurements, self.max_bytes,
+                              self.max_measurements):
+                yield batch
+                batch = Batch()
+            batch.add(measure, serialized, measurements)
+        if batch.measures:
+            yield batch
+
+    def upload(self, batch, stats):
+        data = batch.payload()
+        if self.compress:
+            data = gzip_compress(data)
+        try:
+            self.resource.create_serialized(data, compressed=self.compress)
+        except urllib2.HTTPError, e:
+            error = '{0}: {1}'.format(e, e.read())
+        except (http.HTTPError, urllib2.URLError), e:
+            error = str(e)
+        else:
+            error = None
+        if error is not None:
+            logger.warning('Batch of %s measures failed: %s',
+                           len(batch.measures), error)
+        stats.add_batch(batch, len(data), error)
+
+    def ingest(self, measures):
+        """Upload all the measures of an iterable and return an IngestStats.
+        """
+        stats = IngestStats()
+        # Bounds the batches waiting to be uploaded
+        slots = threading.BoundedSemaphore(self.workers * 2)
+
+        def worker(batch):
+            try:
+                self.upload(batch, stats)
+            except Exception, e:
+                logger.exception('Unexpected error uploading a batch')
+                stats.add_batch(batch, 0, str(e))
+            finally:
+                slots.release()
+
+        thread_pool = ThreadPool(self.workers)
+        try:
+            for batch in self.batches(measures):
+                slots.acquire()
+                thread_pool.apply_async(worker, (batch, ))
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+        stats.end = time.time()
+        logger.info('Ingested %r', stats)
+        return stats
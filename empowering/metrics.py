@@ -0,0 +1,275 @@
+"""
+empowering.metrics
+~~~~~~~~~~~~~~~~~~
+
+Per request metrics, an in-process aggregator and exporters.
+
+Every request made by a client with `metrics_hooks` produces a
+`RequestRecord` which is passed to the hooks once the request is done.
+The record being filled is kept in a thread local, so the layers below the
+executor (connection pool, retries) can add their timings to it.
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urlparse import urlparse
+
+logger = logging.getLogger('empowering.metrics')
+
+_local = threading.local()
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'parse', 'total')
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000,
+           float('inf'))
+
+
+class RequestRecord(object):
+    """Metrics of one request. Timings are in seconds.
+    """
+    def __init__(self, method, uri, page=None):
+        self.method = method
+        self.uri = uri
+        self.path = urlparse(uri).path
+        self.resource = resource_name(self.path)
+        self.page = page
+        self.status = None
+        self.error = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.reused = None
+        self.started = time.time()
+        for phase in PHASES:
+            setattr(self, phase, 0.0)
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def resource_name(path):
+    """Name of the resource of a path, without the API version and ids.
+    """
+    parts = path.strip('/').split('/')
+    if len(parts) > 1 and parts[0][:1] == 'v' and parts[0][1:].isdigit():
+        parts = parts[1:]
+    return parts[0]
+
+
+def current():
+    """Return the record of the request made by this thread, if any.
+    """
+    return getattr(_local, 'record', None)
+
+
+def update(**values):
+    record = current()
+    if record is not None:
+        for key, value in values.items():
+            setattr(record, key, value)
+
+
+def count_retry():
+    record = current()
+    if record is not None:
+        record.retries += 1
+
+
+@contextmanager
+def page(number):
+    """Tag the requests made by this thread within the block with the page
+    number they fetch.
+    """
+    previous = getattr(_local, 'page', None)
+    _local.page = number
+    try:
+        yield
+    finally:
+        _local.page = previous
+
+
+class InstrumentedExecutor(object):
+    """Wrap an executor recording every request and passing it to `hooks`.
+    """
+    def __init__(self, executor, hooks):
+        self.executor = executor
+        self.hooks = hooks
+
+    def __call__(self, request, parser):
+        record = RequestRecord(request.method.upper(), request.uri,
+                               getattr(_local, 'page', None))
+        if isinstance(request.params, basestring):
+            record.bytes_sent = len(request.params)
+
+        def parse(body, code, headers):
+            record.status = code
+            if getattr(parser, 'streaming', False):
+                # The body is read while the result is consumed
+                return parser(body, code, headers)
+            record.bytes_received = len(body)
+            start = time.time()
+            try:
+                return parser(body, code, headers)
+            finally:
+                record.parse = time.time() - start
+        parse.streaming = getattr(parser, 'streaming', False)
+
+        previous, _local.record = current(), record
+        try:
+            return self.executor(request, parse)
+        except Exception, error:
+            record.status = getattr(error, 'code', record.status)
+            record.error = error.__class__.__name__
+            raise
+        finally:
+            _local.record = previous
+            record.total = time.time() - record.started
+            self.emit(record)
+
+    def emit(self, record):
+        for hook in self.hooks:
+            try:
+                hook(record)
+            except Exception:
+                logger.exception('Error in metrics hook %r', hook)
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket where the quantile q falls.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class ResourceStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.reused = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.phases = dict((phase, 0.0) for phase in PHASES)
+        self.latency = Histogram()
+
+    def add(self, record):
+        self.requests += 1
+        if record.error or not 200 <= (record.status or 0) < 400:
+            self.errors += 1
+        self.retries += record.retries
+        self.reused += bool(record.reused)
+        self.bytes_sent += record.bytes_sent
+        self.bytes_received += record.bytes_received
+        for phase in PHASES:
+            self.phases[phase] += getattr(record, phase)
+        self.latency.add(record.total * 1000)
+
+    def summary(self):
+        latency = self.latency
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'reused_connections': self.reused,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'mean_ms': dict(
+                (phase, 1000 * total / self.requests)
+                for phase, total in self.phases.items()
+            ),
+            'p50_ms': latency.quantile(0.5),
+            'p90_ms': latency.quantile(0.9),
+            'p99_ms': latency.quantile(0.99),
+            'histogram_ms': [
+                [bound if bound != float('inf') else None, count]
+                for bound, count in zip(latency.buckets, latency.counts)
+            ],
+        }
+
+
+class Aggregator(object):
+    """Metrics hook keeping per resource counters and latency histograms.
+
+        aggregator = Aggregator()
+        client = Empowering(..., metrics_hooks=[aggregator])
+        ...
+        aggregator.export(LogExporter())
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resources = {}
+
+    def __call__(self, record):
+        with self.lock:
+            stats = self.resources.get(record.resource)
+            if stats is None:
+                stats = self.resources[record.resource] = ResourceStats()
+            stats.add(record)
+
+    def summary(self):
+        with self.lock:
+            return dict(
+                (resource, stats.summary())
+                for resource, stats in self.resources.items()
+            )
+
+    def reset(self):
+        with self.lock:
+            self.resources = {}
+
+    def export(self, exporter):
+        """Pass the summary to an exporter, any object with an
+        `export(summary)` method such as `LogExporter`.
+        """
+        exporter.export(self.summary())
+
+
+class LogExporter(object):
+    def __init__(self, log=logger, level=logging.INFO):
+        self.log = log
+        self.level = level
+
+    def export(self, summary):
+        for resource, stats in sorted(summary.items()):
+            self.log.log(
+                self.level,
+                '%s: %d requests, %d errors, %d retries, p50 %sms, '
+                'p90 %sms, p99 %sms', resource, stats['requests'],
+                stats['errors'], stats['retries'], stats['p50_ms'],
+                stats['p90_ms'], stats['p99_ms']
+            )
+
+
+class JSONLinesExporter(object):
+    """Append every summary as a JSON line to a file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, summary):
+        with open(self.path, 'ab') as output:
+            output.write(json.dumps({'time': time.time(), 'metrics': summary}))
+            output.write('\n')
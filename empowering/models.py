@@ -1,20 +1,55 @@
 from marshmallow import Schema, fields, post_dump
 from marshmallow.validate import OneOf
 
+from empowering.utils import normalize
+
+
 def remove_none(struct):
-    converted = struct.copy()
-    for key, value in struct.items():
-        if isinstance(value, dict):
-            converted[key] = remove_none(value)
-        else:
-            if (value is None or (isinstance(value, bool) and not value)): 
-                del converted[key]
+    return normalize(struct, ('remove_none', 'remove_false'))
+
+
+def prune(data):
+    """Remove the None and False values of a dumped schema.
+
+    Nested schemas are pruned when they are dumped, so unlike `remove_none`
+    this doesn't recurse. Nested dicts are still copied once so the key order,
+    and hence the JSON output, is the same as with `remove_none`.
+    """
+    converted = data.copy()
+    for key, value in data.iteritems():
+        if value is None or value is False:
+            del converted[key]
+        elif isinstance(value, dict):
+            converted[key] = value.copy()
     return converted
 
+
 class BaseSchema(Schema):
     @post_dump
     def remove_none(self, data):
-        return remove_none(data)
+        return prune(data)
+
+
+serializers = {}
+
+
+def get_serializer(schema_class):
+    """Return the shared instance of a schema class.
+    """
+    serializer = serializers.get(schema_class)
+    if serializer is None:
+        serializer = serializers.setdefault(schema_class, schema_class())
+    return serializer
+
+
+def dump(schema_class, obj):
+    """Serialize obj with the shared instance of schema_class.
+
+    All the fields of the schemas are declared, so they are bound once when
+    the schema is instantiated and don't have to be updated on every dump.
+    """
+    return get_serializer(schema_class).dump(obj, update_fields=False).data
+
 
 class Integer(fields.Integer):
     def __init__(self, default=None, **kwargs):
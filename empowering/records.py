@@ -0,0 +1,173 @@
+"""
+empowering.records
+~~~~~~~~~~~~~~~~~~
+
+Compact `__slots__` records for the decoded results.
+
+Record types are generated per result type from the fields seen in its
+items, so every record only keeps its values. Fields unknown to the type of
+a record (or that can't be attribute names) go to its `_extra` dict.
+"""
+import keyword
+import re
+import threading
+
+from empowering.utils import chunks
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class Record(object):
+    """Base of the record types. Records can be read like dicts too.
+    """
+    __slots__ = ('_extra',)
+    _fields = ()
+
+    def __getitem__(self, key):
+        try:
+            if key in self._fields:
+                return getattr(self, key)
+            if self._extra is not None:
+                return self._extra[key]
+        except AttributeError:
+            pass
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key, MISSING) is not MISSING
+
+    def keys(self):
+        keys = [field for field in self._fields if hasattr(self, field)]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def as_dict(self):
+        """Return the record, and the records in it, as dicts.
+        """
+        return dict((key, to_dict(value)) for key, value in self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __repr__(self):
+        return '{0}({1})'.format(
+            self.__class__.__name__,
+            ', '.join('{0}={1!r}'.format(k, v) for k, v in self.items())
+        )
+
+MISSING = object()
+RESERVED = set(dir(Record))
+
+
+def to_dict(value):
+    if isinstance(value, Record):
+        return value.as_dict()
+    if isinstance(value, list):
+        return [to_dict(v) for v in value]
+    return value
+
+
+def slot_name(field):
+    return (isinstance(field, basestring) and IDENTIFIER.match(field) and
+            not keyword.iskeyword(field) and field not in RESERVED)
+
+
+class RecordBuilder(object):
+    """Build the records of one result type.
+
+    `build_many` extends the record type with the new fields of a batch of
+    items; `build` uses the current type and puts new fields in `_extra`.
+    Nested dicts become records of their own types.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.record_type = None
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def extend(self, fields):
+        with self.lock:
+            known = self.record_type and self.record_type._fields or ()
+            new = sorted(set(str(field) for field in fields
+                             if slot_name(field)) - set(known))
+            if self.record_type is None or new:
+                fields = tuple(known) + tuple(new)
+                self.record_type = type(str(self.name), (Record, ), {
+                    '__slots__': fields, '_fields': fields
+                })
+            return self.record_type
+
+    def child(self, field):
+        builder = self.children.get(field)
+        if builder is None:
+            builder = self.children.setdefault(
+                field, RecordBuilder('{0}_{1}'.format(self.name, field))
+            )
+        return builder
+
+    def convert(self, field, value):
+        if isinstance(value, dict):
+            return self.child(field).build(value)
+        if isinstance(value, list):
+            return [self.convert(field, v) for v in value]
+        return value
+
+    def build(self, item, record_type=None):
+        if record_type is None:
+            record_type = self.record_type or self.extend(item)
+        record = record_type.__new__(record_type)
+        record._extra = None
+        slots = record_type._fields
+        for field, value in item.iteritems():
+            value = self.convert(field, value)
+            if field in slots:
+                setattr(record, field, value)
+            else:
+                if record._extra is None:
+                    record._extra = {}
+                record._extra[field] = value
+        return record
+
+    def build_many(self, items):
+        fields = set()
+        for item in items:
+            fields.update(item)
+        record_type = self.extend(fields)
+        return [self.build(item, record_type) for item in items]
+
+    def build_iter(self, items, batch_size=100):
+        for batch in chunks(items, batch_size):
+            for record in self.build_many(batch):
+                yield record
+
+
+builders = {}
+builders_lock = threading.Lock()
+
+
+def record_builder(name):
+    """Return the shared builder of a result type.
+    """
+    with builders_lock:
+        if name not in builders:
+            builders[name] = RecordBuilder(name)
+        return builders[name]
@@ -1,23 +1,38 @@
 # -*- coding: utf-8 -*-
+import json
+import math
+import urllib2
+from multiprocessing.pool import ThreadPool
 from urlparse import urlparse, parse_qs
 
 from libsaas.services import base
-from libsaas import http, parsers
+from libsaas import http
+
+from empowering import metrics
+from empowering.cache import cached_request
+from empowering.codec import default_codec
+from empowering.utils import chunks
 
 class EmpoweringResource(base.RESTResource):
 
+    @base.apimethod
+    def create(self, obj):
+        self.require_collection()
+        request = http.Request('POST', self.get_url(), self.wrap_object(obj))
+        return request, self.parse_json
+
     @base.apimethod
     def update(self, obj, etag):
         self.require_item()
         request = http.Request('PATCH', self.get_url(), self.wrap_object(obj),
                                headers={"If-Match": etag})
-        return request, parsers.parse_json
+        return request, self.parse_json
 
     @base.apimethod
     def delete(self, etag):
         request = http.Request('DELETE', self.get_url(),
                                headers={"If-Match": etag})
-        return request, parsers.parse_json
+        return request, self.parse_json
 
     @base.apimethod
     def get(self, where=None, sort=None):
@@ -25,30 +40,239 @@ class EmpoweringResource(base.RESTResource):
         params = base.get_params(('where', 'sort'), locals())
         request = http.Request('GET', self.get_url(), params)
 
-        return request, parsers.parse_json
-
-    def multiget(self, where=None, sort=None, max_results=None):
-        query = where or ''
-        if max_results:
-            query += '&max_results=%d' % max_results
-        page = 0
-        all_results = {'_items': []}
-        more_items = True
-        while more_items:
-            more_items = False
-
-            if page:
-                paged_query = query + '&page=%s' % page
-            else:
-                paged_query = query
-            result = self.get(where=paged_query, sort=sort)
+        service = self.service
+        cache = getattr(service, 'cache', None)
+        if cache is not None:
+            company_id = getattr(service, 'company_id', '')
+            return request, cached_request(cache, request, company_id,
+                                           self.parse_json)
+        return request, self.parse_json
+
+    @base.apimethod
+    def stream(self, where=None, sort=None):
+        """Get a page as an `empowering.codec.StreamedPage`, which yields
+        its `_items` as the response is read.
+        """
+        sort = sort and sort.replace(' ', '')
+        params = base.get_params(('where', 'sort'), locals())
+        request = http.Request('GET', self.get_url(), params)
+        return request, self.codec.stream_parser()
+
+    @property
+    def service(self):
+        resource = self
+        while resource.parent is not None:
+            resource = resource.parent
+        return resource
+
+    @property
+    def codec(self):
+        return getattr(self.service, 'codec', None) or default_codec
+
+    @property
+    def parse_json(self):
+        return self.codec.parse_json
+
+    @base.apimethod
+    def create_bulk(self, objs):
+        self.require_collection()
+        request = http.Request('POST', self.get_url(),
+                               [self.wrap_object(obj) for obj in objs])
+        return request, self.parse_json
+
+    def create_many(self, objs, chunk_size=100, workers=4):
+        """Create the objects of an iterable POSTing them in chunks.
+
+        Up to `workers` chunks are sent concurrently. Returns a list with a
+        result for every object in the input order, with `_status` set to
+        'OK' (and its `_etag`) or 'ERR' (and its `_issues` or `_error`).
+        """
+        thread_pool = ThreadPool(workers)
+        try:
+            results = thread_pool.imap(self.create_chunk,
+                                       chunks(objs, chunk_size))
+            return [item for result in results for item in result]
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+
+    def create_chunk(self, objs):
+        try:
+            return bulk_results(self.create_bulk(objs), len(objs))
+        except urllib2.HTTPError, e:
+            body = e.read()
+        except http.HTTPError, e:
+            body = e.body
+        except urllib2.URLError, e:
+            body = None
+        except Exception, e:
+            # i.e. httplib errors, so the other chunks are still created
+            error = '{0}: {1}'.format(e.__class__.__name__, e)
+            return [{'_status': 'ERR', '_error': error} for _ in objs]
+        try:
+            return bulk_results(json.loads(body), len(objs))
+        except (ValueError, TypeError):
+            return [{'_status': 'ERR', '_error': str(e)} for _ in objs]
+
+    def multiget(self, where=None, sort=None, max_results=None, workers=None):
+        """Get all the pages of a query.
+
+        With `workers` the pages after the first one are fetched concurrently
+        on a pool of `workers` threads. The number of pages is taken from the
+        `_meta` of the first page; when it is unknown the pages are walked in
+        sequence following `_links.next`.
+        """
+        query = paged_query(where, max_results)
+        result = self.get_page(query, sort=sort)
+        all_results = {'_items': list(result.get('_items', []))}
+
+        pages = workers and next_page(result) and page_count(result)
+        # With an inconsistent `_meta` the pages are walked instead
+        if pages > 1:
+            thread_pool = ThreadPool(min(workers, pages - 1))
+            try:
+                results = thread_pool.map(
+                    lambda page: self.get_page(query, sort=sort, page=page),
+                    range(2, pages + 1)
+                )
+            finally:
+                thread_pool.close()
+                thread_pool.join()
+            for result in results:
+                all_results['_items'].extend(result.get('_items', []))
+            return all_results
+
+        page = next_page(result)
+        while page:
+            result = self.get_page(query, sort=sort, page=page)
             if '_items' in result:
                 all_results['_items'].extend(result['_items'])
-
-            if 'next' in result['_links']:
-                qs = urlparse(result['_links']['next']['href']).query
-                page = parse_qs(qs).get('page', ['0'])[0]
-                more_items = True
+            page = next_page(result)
         return all_results
 
+    def get_page(self, query, sort=None, page=None):
+        if page:
+            query += '&page=%s' % page
+        with metrics.page(page or 1):
+            return self.get(where=query, sort=sort)
+
+    def iter_pages(self, where=None, sort=None, max_results=None,
+                   prefetch=True, page=None):
+        """Yield the pages of a query as they arrive, from `page` on.
+
+        With `prefetch` the next page is requested in a background thread
+        while the current one is being consumed.
+        """
+        query = paged_query(where, max_results)
+        if not prefetch:
+            while True:
+                result = self.get_page(query, sort=sort, page=page)
+                yield result
+                page = next_page(result)
+                if not page:
+                    return
+
+        thread_pool = ThreadPool(1)
+        try:
+            pending = thread_pool.apply_async(self.get_page,
+                                              (query, sort, page))
+            while pending:
+                result = pending.get()
+                page = next_page(result)
+                if page:
+                    pending = thread_pool.apply_async(
+                        self.get_page, (query, sort, page)
+                    )
+                else:
+                    pending = None
+                yield result
+        finally:
+            thread_pool.terminate()
+            thread_pool.join()
+
+    def iter_items(self, where=None, sort=None, max_results=None,
+                   prefetch=True, stream=False):
+        """Yield the `_items` of all the pages of a query one by one.
+
+        With `stream` the items of every page are parsed as the response
+        arrives (see `stream`) instead of decoding whole pages.
+        """
+        if stream:
+            query = paged_query(where, max_results)
+            page = None
+            while True:
+                page_query = query
+                if page:
+                    page_query += '&page=%s' % page
+                with metrics.page(page or 1):
+                    result = self.stream(where=page_query, sort=sort)
+                for item in result:
+                    yield item
+                page = next_page(result.page or {})
+                if not page:
+                    return
+
+        for result in self.iter_pages(where, sort, max_results, prefetch):
+            for item in result.get('_items', []):
+                yield item
+
+
+def paged_query(where=None, max_results=None):
+    query = where or ''
+    if max_results:
+        query += '&max_results=%d' % max_results
+    return query
+
+
+def bulk_results(response, count):
+    """Return the per item results of a bulk POST response.
+
+    Eve rejects the whole batch when a document is invalid, listing the
+    valid ones as OK, so the items without an `_etag` of a rejected batch
+    are ERR.
+    """
+    rejected = False
+    if isinstance(response, dict):
+        rejected = response.get('_status') == 'ERR'
+        if count == 1 and '_items' not in response and '_status' in response:
+            # Eve answers bulk inserts of one document with the document
+            return [response]
+        if '_items' not in response:
+            error = response.get('_error', response)
+            return [{'_status': 'ERR', '_error': error} for _ in range(count)]
+        items = response['_items']
+    else:
+        items = response
+    results = []
+    for item in items:
+        if 'etag' in item and '_etag' not in item:
+            item = {'_status': 'OK', '_etag': item['etag']}
+        if (rejected and '_etag' not in item and
+                item.get('_status') != 'ERR'):
+            item = {'_status': 'ERR', '_error': 'Batch rejected'}
+        results.append(item)
+    if len(results) != count:
+        error = 'Unexpected number of results'
+        return [{'_status': 'ERR', '_error': error} for _ in range(count)]
+    return results
+
+
+def next_page(result):
+    """Return the number of the next page of a result or None.
+    """
+    links = result.get('_links', {})
+    if 'next' in links:
+        qs = urlparse(links['next']['href']).query
+        return parse_qs(qs).get('page', ['0'])[0]
+    return None
+
 
+def page_count(result):
+    """Return the total number of pages from the `_meta` of a result or None.
+    """
+    meta = result.get('_meta') or {}
+    total = meta.get('total')
+    max_results = meta.get('max_results')
+    if not total or not max_results:
+        return None
+    return int(math.ceil(float(total) / max_results))
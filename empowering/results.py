@@ -1,10 +1,152 @@
-from empowering.service import EmpoweringResource
+from empowering.resource import EmpoweringResource
 from empowering.utils import searchparams_to_querystring
 
 import calendar
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from urllib import quote_plus
+
+UPDATED_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
 
 class OTResult(EmpoweringResource):
-    def pull(self, period=None, contract=None):
+    # Field with the period of every result
+    period_field = 'month'
+
+    def pull(self, period=None, contract=None, workers=None, contracts=None,
+             records=False):
+        """Pull the results of a period and contract.
+
+        With `records` the items are `empowering.records` records instead of
+        dicts, which take a fraction of their memory.
+        """
+        if contracts is not None:
+            results = self.pull_contracts(contracts, period, workers=workers)
+            if records:
+                builder = self.record_builder()
+                for contract, items in results.iteritems():
+                    results[contract] = builder.build_many(items)
+            return results
+        result = self.multiget(workers=workers,
+                               **self.pull_params(period, contract))
+        if records:
+            result['_items'] = self.record_builder().build_many(
+                result['_items']
+            )
+        return result
+
+    def record_builder(self):
+        from empowering.records import record_builder
+        return record_builder(self.path)
+
+    def pull_contracts(self, contracts, period=None, workers=None,
+                       max_query_length=4000):
+        """Pull the results of many contracts indexed by contractId.
+
+        Contracts are queried in batches whose URL encoded `where` is at most
+        `max_query_length` long, fetching up to `workers` batches at once.
+        """
+        contracts = [str(contract) for contract in contracts]
+        results = dict((contract, []) for contract in contracts)
+
+        def pull_batch(batch):
+            return self.multiget(**self.pull_params(period, contracts=batch))
+
+        batches = self.contract_batches(contracts, period, max_query_length)
+        thread_pool = ThreadPool(workers or 4)
+        try:
+            for result in thread_pool.imap_unordered(pull_batch, batches):
+                for item in result['_items']:
+                    results.setdefault(item.get('contractId'), []).append(item)
+        finally:
+            thread_pool.close()
+            thread_pool.join()
+        return results
+
+    def contract_batches(self, contracts, period, max_query_length):
+        base_length = len(quote_plus(
+            self.pull_params(period)['where'] + ' and ()'
+        ))
+        batch = []
+        length = base_length
+        for contract in contracts:
+            contract_length = len(quote_plus(
+                '"contractId"=="%s" or ' % contract
+            ))
+            if batch and length + contract_length > max_query_length:
+                yield batch
+                batch = []
+                length = base_length
+            batch.append(contract)
+            length += contract_length
+        if batch:
+            yield batch
+
+    def iter_pull(self, period=None, contract=None, prefetch=True,
+                  stream=False, records=False):
+        """Like `pull` but yielding the items as the pages arrive.
+        """
+        items = self.iter_items(prefetch=prefetch, stream=stream,
+                                **self.pull_params(period, contract))
+        if records:
+            return self.record_builder().build_iter(items)
+        return items
+
+    def pull_frame(self, period=None, contract=None, meta=False,
+                   stream=False):
+        """Pull the results into an `empowering.frames.ResultFrame`,
+        indexed by contractId and period.
+
+        The items are added to the frame as the pages arrive, so the whole
+        result is never held as dicts.
+        """
+        from empowering.frames import ResultFrame
+        return ResultFrame.from_items(
+            self.iter_pull(period, contract, stream=stream),
+            index=('contractId', self.period_field), meta=meta
+        )
+
+    def export(self, path, period=None, contract=None, **kwargs):
+        """Export the results to JSON Lines or CSV files as the pages arrive.
+
+        See `empowering.export.export_results` for the options.
+        """
+        from empowering.export import export_results
+        kwargs.update(self.pull_params(period, contract))
+        return export_results(self, path, **kwargs)
+
+    def pull_updated(self, checkpoints, period=None, contract=None,
+                     workers=None):
+        """Pull only the results updated since the last call.
+
+        The newest `_updated` pulled is kept in the `checkpoints` store (see
+        `empowering.checkpoints`) for this result type and filters. It is only
+        advanced once all the pages have been pulled. Results updated in the
+        same second as the checkpoint are returned again.
+        """
+        key = self.path
+        if period:
+            key += ':month={0}'.format(period)
+        if contract:
+            key += ':contractId={0}'.format(contract)
+        company_id = getattr(self.service, 'company_id', None)
+        if company_id:
+            key = '{0}:{1}'.format(company_id, key)
+
+        since = checkpoints.get(key)
+        params = self.pull_params(period, contract, updated_since=since)
+        result = self.multiget(workers=workers, **params)
+
+        updated = [datetime.strptime(item['_updated'], UPDATED_FORMAT)
+                   for item in result['_items'] if item.get('_updated')]
+        if updated:
+            newest = max(updated).strftime(UPDATED_FORMAT)
+            if newest != since:
+                checkpoints.set(key, newest)
+        return result
+
+    def pull_params(self, period=None, contract=None, updated_since=None,
+                    contracts=None):
         search_params = []
 
         if contract:
@@ -12,6 +154,9 @@ class OTResult(EmpoweringResource):
                 contract = str(contract)
             param = ('contractId', '=', contract)
             search_params.append(param)
+        if contracts:
+            param = ('contractId', 'in', [str(c) for c in contracts])
+            search_params.append(param)
 
         if period:
             if type(period) is not int:
@@ -19,8 +164,11 @@ class OTResult(EmpoweringResource):
             param = ('month', '=', period)
             search_params.append(param)
 
+        if updated_since:
+            search_params.append(('_updated', '>=', updated_since))
+
         query = searchparams_to_querystring(search_params)
-        return self.multiget(where=query)
+        return {'where': query}
 
 
 class OT101Results(OTResult):
@@ -61,8 +209,10 @@ class OT502Results(OTResult):
 
 class OT503Results(OTResult):
     path = 'OT503Results'
+    period_field = 'day'
 
-    def pull(self, period=None, contract=None):
+    def pull_params(self, period=None, contract=None, updated_since=None,
+                    contracts=None):
         # Thanks empowering for keeping the acorded API :D </ironic>
 
         last_day = 31
@@ -72,6 +222,9 @@ class OT503Results(OTResult):
                 contract = str(contract)
             param = ('contractId', '=', contract)
             search_params.append(param)
+        if contracts:
+            param = ('contractId', 'in', [str(c) for c in contracts])
+            search_params.append(param)
         if period:
             if type(period) is not str:
                 # For API coherence period should be int but
@@ -91,9 +244,12 @@ class OT503Results(OTResult):
             ]
             search_params.extend(params)
 
+        if updated_since:
+            search_params.append(('_updated', '>=', updated_since))
+
         query = searchparams_to_querystring(search_params)
-        return self.multiget(where=query, sort='[("day", 1)]',
-                             max_results=last_day)
+        return {'where': query, 'sort': '[("day", 1)]',
+                'max_results': last_day}
 
 
 class OT603Results(OTResult):
@@ -7,33 +7,56 @@ empowering.service
 """
 
 
-import json
+import threading
 from warnings import warn
 
 from libsaas.services import base
-from libsaas import http, parsers
-from libsaas.executors import urllib2_executor as base_executor
+from libsaas import http
 from empowering.executors import urllib2_executor
 from empowering.executors.urllib2_executor import (
     HTTPSClientAuthHandler, HTTPEmpoweringFilterHandler, HTTPAuthEmpowering,
-    API_HOST, DEBUG_API_HOST
+    HTTPNotModifiedHandler, HTTPGzipHandler, API_HOST, DEBUG_API_HOST,
+    ssl_context
 )
+from empowering.codec import get_codec
+from empowering.executors.throttle import (
+    ThrottledExecutor, TokenBucket, AdaptiveLimiter, RetryPolicy
+)
+from empowering.metrics import InstrumentedExecutor
 from empowering.resource import EmpoweringResource
+from empowering.ingest import AmonMeasuresIngestor
 from empowering.results import *
-from empowering import models
 
 
 class Contracts(EmpoweringResource):
     path = 'contracts'
 
     def wrap_object(self, obj):
-        serializer = models.Contract()
-        return serializer.dump(obj).data
+        # The schemas are only loaded when they are used
+        from empowering import models
+        return models.dump(models.Contract, obj)
 
 
 class AmonMeasures(EmpoweringResource):
     path = 'amon_measures'
 
+    @base.apimethod
+    def create_serialized(self, data, compressed=False):
+        self.require_collection()
+        headers = {}
+        if compressed:
+            headers['Content-Encoding'] = 'gzip'
+        request = http.Request('POST', self.get_url(), data, headers=headers)
+        return request, self.parse_json
+
+    def ingest(self, measures, **kwargs):
+        """Upload a stream of measures in batches.
+
+        See `empowering.ingest.AmonMeasuresIngestor` for the options.
+        """
+        kwargs.setdefault('serialize', self.codec.dumps)
+        return AmonMeasuresIngestor(self, **kwargs).ingest(measures)
+
     @base.apimethod
     def get(self):
         raise base.MethodNotSupported
@@ -62,7 +85,7 @@ class AmonMeasuresMeasurements(EmpoweringResource):
     def delete(self, start=None, end=None):
         params = base.get_params(('start', 'end'), locals())
         request = http.Request('DELETE', self.get_url())
-        return request, parsers.parse_json
+        return request, self.parse_json
 
 class ResidentialTimeofuseAmonMeasures(EmpoweringResource):
     path = 'residential_timeofuse_amon_measures'
@@ -91,21 +114,79 @@ class Empowering(base.Resource):
     Empowering Insight Engine Service API.
     """
     def __init__(self, company_id, username=None, password=None, key_file=None,
-                 cert_file=None, version='v1', debug=False):
+                 cert_file=None, version='v1', debug=False, apiroot=None,
+                 cache=None, token_store=None, rate_limit=None, burst=None,
+                 max_retries=3, backoff=0.5, max_concurrency=None,
+                 latency_target=None, metrics_hooks=(), codec='json',
+                 compress_threshold=None, verify_ssl=False, lazy=False):
         self.company_id = str(company_id)
+        # 'json', 'auto', 'ujson', 'simplejson' or an empowering.codec.Codec.
+        # The others may decode to other types than json (i.e. str instead of
+        # unicode), so they are opt-in.
+        self.codec = get_codec(codec)
+        # Request bodies of this size or bigger are gzipped, None to not
+        # compress them. Responses are always asked gzipped.
+        self.compress_threshold = compress_threshold
+        # i.e. empowering.cache.MemoryCache or FileCache
+        self.cache = cache
+        # i.e. empowering.tokens.FileTokenStore shared between processes
+        self.token_store = token_store
+        # Requests per second, retries of 429/5xx and requests in flight,
+        # shared by all the threads using the client
+        self.rate_limiter = None
+        if rate_limit:
+            self.rate_limiter = TokenBucket(rate_limit, burst)
+        self.retry_policy = RetryPolicy(max_retries, backoff)
+        self.concurrency_limiter = None
+        if max_concurrency:
+            self.concurrency_limiter = AdaptiveLimiter(
+                max_concurrency, latency_target=latency_target
+            )
+        # Callables receiving an empowering.metrics.RequestRecord for every
+        # request, i.e. an empowering.metrics.Aggregator
+        self.metrics_hooks = list(metrics_hooks)
         self.key_file = key_file
         self.cert_file = cert_file
+        # Certificates weren't verified when the package patched the default
+        # SSL context, so it is still opt-in
+        self.verify_ssl = verify_ssl
         self.version = version
         self.apiroot = "https://{0}".format(API_HOST)
         if debug:
             self.apiroot = "https://{0}".format(DEBUG_API_HOST)
+        if apiroot:
+            # i.e. a local stand-in server
+            self.apiroot = apiroot.rstrip('/')
         self.login_handler = None
+        self.executor = None
+        self.credentials = None
+        if username and password:
+            self.credentials = (username, password)
+        self.ready = False
+        self.setup_lock = threading.Lock()
+        self.add_filter(self.prepare)
         self.add_filter(self.use_json)
         self.add_filter(self.add_company_id)
         self.add_filter(self.add_cookie_token)
-        self.setup_executor()
-        if username and password:
-            self.login(username, password)
+        self.add_filter(self.bind_executor)
+        # With `lazy` the executor is set up and the login done on the first
+        # request instead
+        if not lazy:
+            self.prepare()
+
+    def prepare(self, request=None):
+        """Set up the executor and log in, if it hasn't been done yet.
+        """
+        if self.ready:
+            return
+        with self.setup_lock:
+            if self.ready:
+                return
+            if self.executor is None:
+                self.setup_executor()
+            if self.credentials and not self.token:
+                self.login(*self.credentials)
+            self.ready = True
 
     @property
     def token(self):
@@ -114,25 +195,41 @@ class Empowering(base.Resource):
     def setup_executor(self, extra_handlers=None):
         if extra_handlers is None:
             extra_handlers = ()
-        extra_handlers += (HTTPEmpoweringFilterHandler(), )
-        if self.key_file and self.cert_file:
-            extra_handlers += (
-                HTTPSClientAuthHandler(self.key_file, self.cert_file),
-            )
-
-        urllib2_executor.use(extra_handlers)
+        # The client auth handler is always used, as it also provides the
+        # pooled and instrumented connections
+        extra_handlers += (HTTPEmpoweringFilterHandler(),
+                           HTTPNotModifiedHandler(),
+                           HTTPGzipHandler(self.compress_threshold),
+                           HTTPSClientAuthHandler(self.key_file,
+                                                  self.cert_file,
+                                                  verify=self.verify_ssl))
+
+        self.executor = ThrottledExecutor(
+            urllib2_executor.Urllib2Executor(extra_handlers),
+            self.rate_limiter, self.concurrency_limiter, self.retry_policy
+        )
+        if self.metrics_hooks:
+            self.executor = InstrumentedExecutor(self.executor,
+                                                 self.metrics_hooks)
+        urllib2_executor.install_dispatcher()
+
+    def bind_executor(self, request):
+        request.executor = self.executor
 
     def use_json(self, request):
         if request.method.upper() not in http.URLENCODE_METHODS:
             request.headers['Content-Type'] = 'application/json'
-            request.params = json.dumps(request.params)
+            # Already serialized bodies are sent as they are
+            if not isinstance(request.params, basestring):
+                request.params = self.codec.dumps(request.params)
 
     def add_company_id(self, request):
         request.headers['X-CompanyId'] = self.company_id
 
     def add_cookie_token(self, request):
-        if self.token:
-            request.headers['Cookie'] = "iPlanetDirectoryPro=%s" % self.token
+        token = self.login_handler and self.login_handler.current_token()
+        if token:
+            request.headers['Cookie'] = "iPlanetDirectoryPro=%s" % token
 
     def get_url(self):
         return "{0}/{1}".format(self.apiroot, self.version)
@@ -141,7 +238,10 @@ class Empowering(base.Resource):
         if self.login_handler and self.token:
             return {'success': True, 'token': self.token}
         endpoint = "{}/authn/login".format(self.apiroot)
-        self.login_handler = HTTPAuthEmpowering(user, password, endpoint)
+        self.login_handler = HTTPAuthEmpowering(
+            user, password, endpoint, self.token_store,
+            ssl_context(self.verify_ssl)
+        )
         auth = self.login_handler.login()
         self.setup_executor((self.login_handler, ))
         return auth
@@ -156,8 +256,7 @@ class Empowering(base.Resource):
             self.add_company_id(request)
             self.add_cookie_token(request)
 
-            executor = base_executor.base.current_executor()
-            auth = executor(request, parsers.parse_json)
+            auth = self.executor(request, self.codec.parse_json)
             if auth.get('success'):
                 self.login_handler.token = None
             return auth
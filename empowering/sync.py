@@ -0,0 +1,307 @@
+"""
+empowering.sync
+~~~~~~~~~~~~~~~
+
+Pull the results of many contracts and periods on a pool of processes,
+each one with its own client, writing them to JSON Lines files.
+
+The work is split in tasks of a result type, a period and a batch of
+contracts. Every task is written to its own file
+(`<output>/<result>/<period>/<batch>-<hash>.jsonl`, the hash being of the
+contracts of the batch), which only appears once the task is done, so
+syncing again skips the tasks already done, as long as the batches are the
+same.
+"""
+import argparse
+import errno
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from hashlib import sha1
+
+from empowering.cli import (
+    add_client_arguments, client_from_args, result_name, setup_logging
+)
+from empowering.metrics import Aggregator
+from empowering.utils import chunks
+
+logger = logging.getLogger('empowering.sync')
+
+
+class SyncTask(object):
+    def __init__(self, result, period, batch, contracts, path):
+        self.result = result
+        self.period = period
+        self.batch = batch
+        self.contracts = contracts
+        self.path = path
+
+    def __repr__(self):
+        return '<SyncTask {0} {1} batch {2}>'.format(self.result,
+                                                     self.period, self.batch)
+
+
+class SyncStats(object):
+    def __init__(self, tasks=0):
+        self.start = time.time()
+        self.end = None
+        self.tasks = tasks
+        self.done = 0
+        self.skipped = 0
+        self.items = 0
+        self.requests = 0
+        self.retries = 0
+        self.task_retries = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.failures = []
+
+    @property
+    def elapsed(self):
+        return (self.end or time.time()) - self.start
+
+    @property
+    def items_per_second(self):
+        return self.items / (self.elapsed or 1)
+
+    @property
+    def requests_per_second(self):
+        return self.requests / (self.elapsed or 1)
+
+    def add(self, outcome):
+        self.done += 1
+        self.items += outcome['items']
+        self.requests += outcome['requests']
+        self.retries += outcome['retries']
+        self.task_retries += outcome['task_retries']
+        self.errors += outcome['errors']
+        self.bytes_received += outcome['bytes_received']
+        if outcome['error'] is not None:
+            self.failures.append((outcome['task'], outcome['error']))
+
+    def __repr__(self):
+        return ('<SyncStats tasks={0}/{1} skipped={2} failures={3} items={4} '
+                'requests={5} retries={6} task_retries={7} errors={8} '
+                '{9:.1f} items/s {10:.1f} requests/s>'.format(
+                    self.done, self.tasks, self.skipped, len(self.failures),
+                    self.items, self.requests, self.retries,
+                    self.task_retries, self.errors, self.items_per_second,
+                    self.requests_per_second))
+
+
+def month_range(start, end):
+    """Return the periods (YYYYMM) from start to end, both included.
+    """
+    year, month = divmod(int(start), 100)
+    periods = []
+    while year * 100 + month <= int(end):
+        periods.append(year * 100 + month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return periods
+
+
+def batch_hash(contracts):
+    return sha1('\n'.join(contracts)).hexdigest()[:12]
+
+
+def make_tasks(output, results, periods, contracts, batch_size=200):
+    batches = list(chunks(contracts, batch_size))
+    tasks = []
+    for result in results:
+        for period in periods:
+            for batch, batch_contracts in enumerate(batches):
+                name = '{0:05d}-{1}.jsonl'.format(batch, batch_hash(
+                    batch_contracts
+                ))
+                path = os.path.join(output, result, str(period), name)
+                tasks.append(SyncTask(result, period, batch, batch_contracts,
+                                      path))
+    return tasks
+
+
+# Client and metrics of the worker process, set by `init_worker`
+client = None
+aggregator = None
+init_error = None
+
+
+def init_worker(client_args):
+    global client, aggregator, init_error
+    # Interrupting is handled by the parent
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    aggregator = Aggregator()
+    try:
+        client = client_from_args(client_args, metrics_hooks=[aggregator])
+    except Exception, e:
+        # Raising would make the pool start new workers forever
+        init_error = 'Creating the client: {0}: {1}'.format(
+            e.__class__.__name__, e
+        )
+
+
+def write_items(path, results, dumps):
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    items = 0
+    tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as output:
+        for contract in sorted(results):
+            for item in results[contract]:
+                output.write(dumps(item))
+                output.write('\n')
+                items += 1
+    os.rename(tmp_path, path)
+    return items
+
+
+def run_task(task, retries=2, threads=4, backoff=1):
+    """Pull and write a task in a worker, retrying it up to `retries` times.
+
+    Returns the items written and the requests made, or the error.
+    """
+    aggregator.reset()
+    outcome = {'task': task, 'items': 0, 'error': init_error,
+               'task_retries': 0}
+    for attempt in range(retries + 1):
+        if init_error is not None:
+            break
+        try:
+            resource = getattr(client, task.result + '_results')()
+            results = resource.pull(task.period, contracts=task.contracts,
+                                    workers=threads)
+            outcome['items'] = write_items(task.path, results,
+                                           client.codec.dumps)
+            outcome['error'] = None
+            break
+        except Exception, e:
+            outcome['error'] = '{0}: {1}'.format(e.__class__.__name__, e)
+            if attempt < retries:
+                logger.warning('%r failed (%s), retrying', task,
+                               outcome['error'])
+                outcome['task_retries'] += 1
+                time.sleep(backoff * 2 ** attempt)
+    summary = aggregator.summary().values()
+    outcome['requests'] = sum(stats['requests'] for stats in summary)
+    outcome['errors'] = sum(stats['errors'] for stats in summary)
+    outcome['bytes_received'] = sum(stats['bytes_received']
+                                    for stats in summary)
+    outcome['retries'] = sum(stats['retries'] for stats in summary)
+    return outcome
+
+
+def run_task_star(args):
+    return run_task(*args)
+
+
+def sync(tasks, client_args, processes=None, threads=4, retries=2,
+         progress_interval=10):
+    """Run the tasks on a pool of `processes`, each one with a client
+    created from `client_args` (see `empowering.cli.client_from_args`).
+
+    Tasks whose file already exists are skipped. Returns a `SyncStats`.
+    """
+    stats = SyncStats(len(tasks))
+    pending = [task for task in tasks if not os.path.exists(task.path)]
+    stats.skipped = len(tasks) - len(pending)
+    stats.done = stats.skipped
+    if not pending:
+        stats.end = time.time()
+        return stats
+    processes = min(processes or multiprocessing.cpu_count(), len(pending))
+    logger.info('Syncing %d tasks on %d processes (%d already done)',
+                len(pending), processes, stats.skipped)
+    pool = multiprocessing.Pool(processes, init_worker, (client_args, ))
+    try:
+        outcomes = pool.imap_unordered(
+            run_task_star, [(task, retries, threads) for task in pending]
+        )
+        reported = time.time()
+        for outcome in outcomes:
+            stats.add(outcome)
+            if outcome['error'] is not None:
+                logger.error('%r failed: %s', outcome['task'],
+                             outcome['error'])
+            if time.time() - reported >= progress_interval:
+                reported = time.time()
+                logger.info('Progress %r', stats)
+        pool.close()
+    except:
+        # Interrupted or failed, the pool must be stopped before joining it
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    stats.end = time.time()
+    return stats
+
+
+def read_contracts(args):
+    contracts = []
+    if args.contracts:
+        contracts.extend(args.contracts.split(','))
+    if args.contracts_file:
+        with open(args.contracts_file) as contracts_file:
+            contracts.extend(contracts_file.read().split())
+    unique = []
+    seen = set()
+    for contract in (contract.strip() for contract in contracts):
+        if contract and contract not in seen:
+            seen.add(contract)
+            unique.append(contract)
+    return unique
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Pull the results of many contracts and periods on a '
+                    'pool of processes to JSON Lines files.'
+    )
+    parser.add_argument('--contracts', help='Comma separated contracts')
+    parser.add_argument('--contracts-file',
+                        help='File with the contracts, one per line')
+    parser.add_argument('--results', default='ot101',
+                        help='Comma separated result types, i.e. ot101,ot503')
+    parser.add_argument('--start', type=int, required=True,
+                        help='First period, i.e. 201501')
+    parser.add_argument('--end', type=int,
+                        help='Last period, the start one by default')
+    parser.add_argument('--output', default='.',
+                        help='Directory where the results are written')
+    parser.add_argument('--processes', type=int,
+                        help='Worker processes, one per CPU by default')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='Requests in flight per process')
+    parser.add_argument('--batch-size', type=int, default=200,
+                        help='Contracts per task')
+    parser.add_argument('--task-retries', type=int, default=2,
+                        help='Times a failed task is retried')
+    parser.add_argument('--progress-interval', type=float, default=10,
+                        help='Seconds between progress reports')
+    add_client_arguments(parser)
+    args = parser.parse_args(argv)
+    setup_logging(args)
+
+    if not args.company_id:
+        parser.error('A company id is needed, see --company-id')
+    contracts = read_contracts(args)
+    if not contracts:
+        parser.error('No contracts, see --contracts and --contracts-file')
+    try:
+        results = [result_name(name) for name in args.results.split(',')]
+    except ValueError, e:
+        parser.error(str(e))
+    periods = month_range(args.start, args.end or args.start)
+    tasks = make_tasks(args.output, results, periods, contracts,
+                       args.batch_size)
+    stats = sync(tasks, args, args.processes, args.threads,
+                 args.task_retries, args.progress_interval)
+    logger.info('Done %r', stats)
+    for task, error in stats.failures:
+        logger.error('%r failed: %s', task, error)
+    return 1 if stats.failures else 0
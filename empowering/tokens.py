@@ -0,0 +1,112 @@
+"""
+empowering.tokens
+~~~~~~~~~~~~~~~~~
+
+Token store shared by all the processes logging in with the same user.
+"""
+import fcntl
+import json
+import logging
+import threading
+import time
+
+from empowering.utils import atomic_write
+
+logger = logging.getLogger('empowering.tokens')
+
+
+class FileTokenStore(object):
+    """Keep the auth tokens in a JSON file shared between processes.
+
+    Tokens are considered expired after `ttl` seconds. Logins are done
+    holding an exclusive lock of the file, so when a token expires only one
+    process logs in and the others wait and then use its token. Tokens older
+    than `ttl - refresh_margin` are refreshed in the background while they
+    are still used.
+    """
+    def __init__(self, path, ttl=3600, refresh_margin=300, check_interval=5):
+        self.path = path
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.refreshing = set()
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as tokens_file:
+                return json.load(tokens_file)
+        except (IOError, ValueError):
+            return {}
+
+    def save(self, tokens):
+        # Only readable by its owner
+        with atomic_write(self.path) as tokens_file:
+            json.dump(tokens, tokens_file)
+
+    def age(self, auth):
+        return time.time() - auth.get('obtained', 0)
+
+    def get(self, key):
+        """Return the stored auth of key if it has not expired.
+        """
+        auth = self.load().get(key)
+        if auth and self.age(auth) < self.ttl:
+            return auth
+        return None
+
+    def fetch(self, key, login, stale_token=None, refresh=False):
+        """Return a valid auth for key, calling `login` if there is none.
+
+        If the stored token is `stale_token` (i.e. it has been rejected) a new
+        one is requested. With `refresh` tokens close to their expiry are
+        renewed too, unless another process is already doing it, in which
+        case None is returned.
+        """
+        with open(self.path + '.lock', 'a') as lock_file:
+            flags = fcntl.LOCK_EX
+            if refresh:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(lock_file, flags)
+            except IOError:
+                return None
+            try:
+                auth = self.load().get(key)
+                if (auth and self.age(auth) < self.ttl and
+                        auth['token'] != stale_token and
+                        not (refresh and self.needs_refresh(auth))):
+                    return auth
+                logger.debug('Logging in for %s', key)
+                auth = dict(login(), obtained=time.time())
+                tokens = self.load()
+                tokens[key] = auth
+                self.save(tokens)
+                return auth
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def needs_refresh(self, auth):
+        return self.age(auth) >= self.ttl - self.refresh_margin
+
+    def refresh_in_background(self, key, login):
+        """Refresh the token of key in a thread, unless another thread or
+        process is already doing it.
+        """
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self.fetch(key, login, refresh=True)
+            except Exception:
+                logger.exception('Error refreshing the token of %s', key)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        thread = threading.Thread(target=refresh)
+        thread.daemon = True
+        thread.start()
@@ -1,8 +1,19 @@
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
+import anydbm
+import calendar
+import json
 import logging
+import os
+import re
+import tempfile
 import uuid
 import times
 import ssl
+import threading
+import zlib
+import arrow
 from arrow.parser import DateTimeParser
 
 
@@ -24,19 +35,105 @@ def fix_ssl_verify():
         ssl._create_default_https_context = _create_unverified_https_context
 
 
+DROP = object()
+
+NORMALIZE_RULES = {
+    'remove_none': lambda value: DROP if value is None else value,
+    'remove_false': lambda value: DROP if value is False else value,
+    'null_to_none': (
+        lambda value: None if isinstance(value, str) and not value else value
+    ),
+    'false_to_none': lambda value: None if value is False else value,
+    'none_to_false': lambda value: False if value is None else value,
+}
+
+CONTAINERS = (dict, list, tuple)
+
+
+def normalize(struct, rules, inplace=False, tuples_as_lists=False):
+    """Apply a list of rules to the values of a structure in one traversal.
+
+    Rules are names of `NORMALIZE_RULES` or functions taking a value and
+    returning the new value or `DROP` to remove its key. They are applied to
+    the values of every dict found descending through dicts, lists and
+    tuples.
+
+    With `inplace` the dicts and lists are modified, otherwise only the
+    branches with changes are copied and the rest are shared with `struct`.
+    With `tuples_as_lists` the tuples are returned as lists.
+    """
+    funcs = [NORMALIZE_RULES.get(rule, rule) for rule in rules]
+
+    def convert(value):
+        for func in funcs:
+            value = func(value)
+            if value is DROP:
+                break
+        return value
+
+    def walk(struct):
+        if isinstance(struct, dict):
+            converted = struct if inplace else None
+            items = struct.items() if inplace else struct.iteritems()
+            for key, value in items:
+                if isinstance(value, CONTAINERS):
+                    new_value = walk(value)
+                else:
+                    new_value = convert(value)
+                if new_value is value:
+                    continue
+                if converted is None:
+                    converted = struct.copy()
+                if new_value is DROP:
+                    del converted[key]
+                else:
+                    converted[key] = new_value
+            return struct if converted is None else converted
+        elif isinstance(struct, (list, tuple)):
+            converted = None
+            for index, value in enumerate(struct):
+                if not isinstance(value, CONTAINERS):
+                    continue
+                new_value = walk(value)
+                if new_value is value:
+                    continue
+                if converted is None:
+                    if inplace and isinstance(struct, list):
+                        converted = struct
+                    else:
+                        converted = list(struct)
+                converted[index] = new_value
+            if isinstance(struct, tuple):
+                if tuples_as_lists:
+                    return list(struct) if converted is None else converted
+                if converted is not None:
+                    return tuple(converted)
+            return struct if converted is None else converted
+        return struct
+
+    return walk(struct)
+
+
+def normalize_copy(struct, rules, tuples_as_lists=False):
+    """Like `normalize`, but always returning a new top level dict or list,
+    as the functions below have always done, so callers can modify it.
+    Nested branches without changes are still shared with `struct`.
+    """
+    result = normalize(struct, rules, tuples_as_lists=tuples_as_lists)
+    if result is struct:
+        if isinstance(struct, dict):
+            result = struct.copy()
+        elif isinstance(struct, list):
+            result = list(struct)
+    return result
+
+
 def remove_none(struct, context=None):
     if not context:
         context = {}
     if 'xmlrpc' in context:
         return struct
-    converted = struct.copy()
-    for key, value in struct.items():
-        if isinstance(value, dict):
-            converted[key] = remove_none(value)
-        else:
-            if value is None or (isinstance(value, bool) and not value):
-                del converted[key]
-    return converted
+    return normalize_copy(struct, ('remove_none', 'remove_false'))
 
 
 def null_to_none(struct, context=None):
@@ -44,14 +141,7 @@ def null_to_none(struct, context=None):
         context = {}
     if 'xmlrpc' in context:
         return struct
-    converted = struct.copy()
-    for key, value in struct.items():
-        if isinstance(value, dict):
-            converted[key] = null_to_none(value)
-        else:
-            if isinstance(value, str) and not value:
-                converted[key] = None
-    return converted
+    return normalize_copy(struct, ('null_to_none', ))
 
 
 def false_to_none(struct, context=None):
@@ -59,29 +149,146 @@ def false_to_none(struct, context=None):
         context = {}
     if 'xmlrpc' in context:
         return struct
-    converted = struct.copy()
-    for key, value in struct.items():
-        if isinstance(value, dict):
-            converted[key] = false_to_none(value)
-        else:
-            if isinstance(value, bool) and not value:
-                converted[key] = None
-    return converted
+    return normalize_copy(struct, ('false_to_none', ))
 
 
 def none_to_false(struct):
-    if isinstance(struct, (list, tuple)):
-        return [none_to_false(x) for x in struct]
-    converted = struct.copy()
-    for key, value in struct.items():
-        if isinstance(value, dict):
-            converted[key] = none_to_false(value)
-        elif isinstance(value, (list, tuple)):
-            converted[key] = none_to_false(value)
+    # Tuples have always been returned as lists
+    return normalize_copy(struct, ('none_to_false', ), tuples_as_lists=True)
+
+
+def flatten(struct, sep='.', prefix=''):
+    """Flatten the nested dicts of struct into one level of keys joined by
+    `sep`, i.e. {'results': {'value': 1}} -> {'results.value': 1}.
+
+    Lists are left as values.
+    """
+    flat = {}
+    for key, value in struct.iteritems():
+        key = prefix + key
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, sep, key + sep))
         else:
-            if value is None:
-                converted[key] = False
-    return converted
+            flat[key] = value
+    return flat
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+@contextmanager
+def atomic_write(path):
+    """Write a temporary file in the directory of `path`, which replaces it
+    when the block ends without errors, so it is never seen half written.
+
+    The file is only readable by its owner, as created by `mkstemp`.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            yield tmp_file
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def gzip_compress(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class GzipReader(object):
+    """File-like object decompressing a gzip stream as it is read.
+    """
+    def __init__(self, fileobj, chunk_size=16 * 1024):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = ''
+        self.eof = False
+
+    def fill(self):
+        data = self.fileobj.read(self.chunk_size)
+        if data:
+            self.buffer += self.decompressor.decompress(data)
+        else:
+            self.buffer += self.decompressor.flush()
+            self.eof = True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self.buffer]
+            while not self.eof:
+                self.buffer = ''
+                self.fill()
+                chunks.append(self.buffer)
+            self.buffer = ''
+            return ''.join(chunks)
+        while len(self.buffer) < size and not self.eof:
+            self.fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while '\n' not in self.buffer and not self.eof:
+            self.fill()
+        end = self.buffer.find('\n') + 1 or len(self.buffer)
+        if size is not None and 0 <= size < end:
+            end = size
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def close(self):
+        self.fileobj.close()
+
+
+MISSING = object()
+
+
+class LRUCache(object):
+    """Bounded cache keeping the recently used entries.
+
+    Entries live in two generations of at most `maxsize` entries. When the
+    current generation is full it becomes the old one, and the entries of the
+    old one that were not used meanwhile are dropped.
+    """
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.current = {}
+        self.old = {}
+
+    def get(self, key, default=None):
+        value = self.current.get(key, MISSING)
+        if value is MISSING:
+            value = self.old.get(key, MISSING)
+            if value is MISSING:
+                return default
+            self.set(key, value)
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            if len(self.current) >= self.maxsize:
+                self.old, self.current = self.current, {}
+            self.current[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.current, self.old = {}, {}
+
+    def __len__(self):
+        return len(self.current) + len(self.old)
+
+
+uuid_cache = LRUCache()
 
 
 def make_uuid(model, model_id):
@@ -89,8 +296,74 @@ def make_uuid(model, model_id):
         model = model.encode('utf-8')
     if isinstance(model_id, unicode):
         model_id = model_id.encode('utf-8')
+    # Keyed on the token, as ids like 1, 1.0 and True are equal dict keys
     token = '%s,%s' % (model, model_id)
-    return str(uuid.uuid5(uuid.NAMESPACE_OID, token))
+    result = uuid_cache.get(token)
+    if result is None:
+        result = str(uuid.uuid5(uuid.NAMESPACE_OID, token))
+        uuid_cache.set(token, result)
+    return result
+
+
+def make_uuids(model, model_ids, index=None):
+    """Return the uuids of many ids of a model, adding them to `index` if
+    given.
+    """
+    # Iterators are consumed once, by both the uuids and the index
+    model_ids = list(model_ids)
+    result = [make_uuid(model, model_id) for model_id in model_ids]
+    if index is not None:
+        index.update(model, model_ids, result)
+    return result
+
+
+class UUIDIndex(object):
+    """Reverse index from the uuids of `make_uuid` to their (model, id).
+
+    Kept in memory, or in a dbm file when a `path` is given so it can be
+    reused between runs.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        if path:
+            self.db = anydbm.open(path, 'c')
+        else:
+            self.db = {}
+
+    def add(self, model, model_id):
+        result = make_uuid(model, model_id)
+        self.db[result] = json.dumps([model, model_id])
+        return result
+
+    def update(self, model, model_ids, uuids=None):
+        model_ids = list(model_ids)
+        if uuids is None:
+            uuids = [make_uuid(model, model_id) for model_id in model_ids]
+        for model_id, result in zip(model_ids, uuids):
+            self.db[result] = json.dumps([model, model_id])
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __getitem__(self, key):
+        return tuple(json.loads(self.db[str(key)]))
+
+    def __contains__(self, key):
+        return str(key) in self.db
+
+    def __len__(self):
+        return len(self.db)
+
+    def sync(self):
+        if self.path:
+            self.db.sync()
+
+    def close(self):
+        if self.path:
+            self.db.close()
 
 
 def make_utc_timestamp(timestamp, timezone='Europe/Madrid'):
@@ -116,37 +389,269 @@ def datestring_to_epoch(date_string):
         dt = date_string
     return dt.strftime('%s')
 
-def searchparams_to_querystring(search_params):
-    operator_map = {
-        '=': '==',
-        '>=': '>=',
-        '>': '>',
-        '<': '<',
-        '<=': '<=',
-    }
+SIMPLE_TIMESTAMP = re.compile(r'^\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d$')
 
-    query = ''
+
+def parse_simple_timestamp(timestamp):
+    """Parse a 'YYYY-MM-DD HH:MM:SS' timestamp (or with a 'T') to a naive
+    datetime, or return None if it has any other format.
+    """
+    if SIMPLE_TIMESTAMP.match(timestamp):
+        return datetime(
+            int(timestamp[:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+            int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])
+        )
+    return None
+
+
+class UTCOffsets(object):
+    """Table of the offsets between local and universal time of a timezone.
+
+    Offsets are computed once per hour with the same conversions as
+    `make_utc_timestamp` and `make_local_timestamp`, so the results are the
+    same as theirs for timezones changing their offset on the hour, like
+    Europe/Madrid.
+    """
+    def __init__(self, timezone):
+        self.timezone = timezone
+        self.local_deltas = {}
+        self.utc_deltas = {}
+
+    def local_delta(self, hour):
+        delta = self.local_deltas.get(hour)
+        if delta is None:
+            delta = times.to_universal(hour, self.timezone) - hour
+            self.local_deltas[hour] = delta
+        return delta
+
+    def utc_delta(self, hour):
+        delta = self.utc_deltas.get(hour)
+        if delta is None:
+            local = times.to_local(hour, self.timezone).replace(tzinfo=None)
+            delta = local - hour
+            self.utc_deltas[hour] = delta
+        return delta
+
+    def to_universal(self, local_dt):
+        local_dt = local_dt.replace(tzinfo=None)
+        hour = local_dt.replace(minute=0, second=0, microsecond=0)
+        return local_dt + self.local_delta(hour)
+
+    def to_local(self, utc_dt):
+        hour = utc_dt.replace(minute=0, second=0, microsecond=0)
+        return utc_dt + self.utc_delta(hour)
+
+    def datetime64_deltas(self, values, delta):
+        """Return the deltas of a numpy datetime64 array in microseconds.
+        """
+        import numpy
+        hours, inverse = numpy.unique(values.astype('datetime64[h]'),
+                                      return_inverse=True)
+        deltas = numpy.array(
+            [delta(hour) if hour is not None else 0
+             for hour in hours.astype(object)],
+            dtype='timedelta64[us]'
+        )
+        return deltas[inverse]
+
+
+utc_offsets_by_timezone = {}
+
+
+def utc_offsets(timezone):
+    offsets = utc_offsets_by_timezone.get(timezone)
+    if offsets is None:
+        offsets = utc_offsets_by_timezone.setdefault(
+            timezone, UTCOffsets(timezone)
+        )
+    return offsets
+
+
+def is_datetime64_array(values):
+    # numpy is optional, so check for its arrays without importing it
+    return (type(values).__name__ == 'ndarray' and
+            values.dtype.kind == 'M')
+
+
+def datetime64_to_strings(values, separator, suffix=''):
+    import numpy
+    strings = numpy.datetime_as_string(values.astype('datetime64[us]'))
+    result = []
+    for string in strings.tolist():
+        if string == 'NaT':
+            result.append(None)
+            continue
+        if string.endswith('.000000'):
+            string = string[:-7]
+        result.append(string.replace('T', separator) + suffix)
+    return result
+
+
+def make_utc_timestamps(timestamps, timezone='Europe/Madrid', epoch=False):
+    """Batch version of `make_utc_timestamp`.
+
+    Takes a sequence of local timestamps or a numpy datetime64 array and
+    returns a list of ISO strings, or of epochs if `epoch` is set.
+    """
+    offsets = utc_offsets(timezone)
+    if is_datetime64_array(timestamps):
+        import numpy
+        timestamps = timestamps.astype('datetime64[us]')
+        utc = timestamps + offsets.datetime64_deltas(
+            timestamps, offsets.local_delta
+        )
+        if epoch:
+            seconds = utc.astype('datetime64[s]').astype('int64')
+            return [None if isnat else value
+                    for value, isnat in zip(seconds.tolist(),
+                                            numpy.isnat(utc).tolist())]
+        return datetime64_to_strings(utc, 'T', 'Z')
+
+    result = []
+    for timestamp in timestamps:
+        if not timestamp:
+            result.append(None)
+            continue
+        if isinstance(timestamp, basestring):
+            local_dt = parse_simple_timestamp(timestamp)
+            if local_dt is None:
+                local_dt = arrow.get(timestamp).to('UTC').naive
+        else:
+            local_dt = timestamp
+        if isinstance(local_dt, datetime):
+            utc = offsets.to_universal(local_dt)
+        else:
+            utc = times.to_universal(local_dt, timezone)
+        if epoch:
+            result.append(calendar.timegm(utc.timetuple()))
+        else:
+            result.append(utc.isoformat('T') + 'Z')
+    return result
+
+
+def make_local_timestamps(timestamps, timezone='Europe/Madrid'):
+    """Batch version of `make_local_timestamp`.
+
+    Takes a sequence of universal timestamps or a numpy datetime64 array and
+    returns a list of 'YYYY-MM-DD HH:MM:SS' local strings.
+    """
+    offsets = utc_offsets(timezone)
+    if is_datetime64_array(timestamps):
+        timestamps = timestamps.astype('datetime64[s]')
+        local = timestamps + offsets.datetime64_deltas(
+            timestamps, offsets.utc_delta
+        )
+        return datetime64_to_strings(local.astype('datetime64[s]'), ' ')
+
+    result = []
+    for timestamp in timestamps:
+        if not timestamp:
+            result.append(None)
+            continue
+        if isinstance(timestamp, basestring):
+            timestamp = timestamp.replace('Z', '')
+            utc = parse_simple_timestamp(timestamp)
+            if utc is None:
+                utc = times.parse(timestamp)
+        else:
+            utc = timestamp
+        if isinstance(utc, datetime) and utc.tzinfo is None:
+            local = offsets.to_local(utc)
+            result.append('%04d-%02d-%02d %02d:%02d:%02d' % (
+                local.year, local.month, local.day,
+                local.hour, local.minute, local.second
+            ))
+        else:
+            result.append(make_local_timestamp(utc, timezone))
+    return result
+
+
+def datestrings_to_epoch(date_strings):
+    """Batch version of `datestring_to_epoch`.
+
+    Takes a sequence of dates or a numpy datetime64 array. Every distinct
+    date is only converted once.
+    """
+    if is_datetime64_array(date_strings):
+        import numpy
+        days, inverse = numpy.unique(date_strings.astype('datetime64[D]'),
+                                     return_inverse=True)
+        epochs = [day and datestring_to_epoch(day.isoformat())
+                  for day in days.astype(object)]
+        return [epochs[index] for index in inverse]
+
+    epochs = {}
+    result = []
+    for date_string in date_strings:
+        if isinstance(date_string, datetime):
+            result.append(datestring_to_epoch(date_string))
+            continue
+        epoch = epochs.get(date_string)
+        if epoch is None:
+            epoch = datestring_to_epoch(date_string)
+            epochs[date_string] = epoch
+        result.append(epoch)
+    return result
+
+
+def searchparams_to_querystring(search_params, join='and'):
+    """Build an Eve `where` query from a list of search params.
+
+    Params are (field, operator, value) tuples, where the 'in' operator takes
+    a list of values, or (join, search_params) tuples to group params joined
+    by 'and' or 'or'.
+    """
     query = ''
     for param in search_params:
         if query:
             # is not the first
-            query += ' and '
+            query += ' %s ' % join
+
+        if len(param) == 2:
+            group_join, group_params = param
+            if group_join not in ('and', 'or'):
+                raise Exception('Unsuported join "%s"' % group_join)
+            query += '(%s)' % searchparams_to_querystring(group_params,
+                                                          group_join)
+            continue
 
         field = param[0]
         operator = param[1]
         value = param[2]
 
+        if operator == 'in':
+            if not value:
+                raise Exception('No values for "in" operand')
+            query += '(%s)' % ' or '.join(
+                searchparam_to_querystring(field, '==', item)
+                for item in value
+            )
+            continue
+
         try:
-            query_operator = operator_map[operator]
+            query_operator = OPERATOR_MAP[operator]
         except KeyError:
-            raise Exception('Unsuported operand "%s"' % operand)
-
-        if type(value) in [str,unicode]:
-            # Add "" to the value
-            query_value = '"%s"' % value
-        else:
-            query_value = '%s' % value
+            raise Exception('Unsuported operand "%s"' % operator)
 
-        query += '"%s"%s%s' % (field, query_operator, query_value)
+        query += searchparam_to_querystring(field, query_operator, value)
 
     return query
+
+
+OPERATOR_MAP = {
+    '=': '==',
+    '>=': '>=',
+    '>': '>',
+    '<': '<',
+    '<=': '<=',
+}
+
+
+def searchparam_to_querystring(field, query_operator, value):
+    if type(value) in [str,unicode]:
+        # Add "" to the value
+        query_value = '"%s"' % value
+    else:
+        query_value = '%s' % value
+
+    return '"%s"%s%s' % (field, query_operator, query_value)
@@ -8,8 +8,15 @@ Python library for the Empowering REST API.
 :copyright: (c) 2013 by GISCE-TI, S.L., see AUTHORS for more details.
 :license: MIT, see LICENSE for more details.
 """
+import re
+
 from setuptools import setup, find_packages
 
+with open('empowering/__init__.py') as init_file:
+    VERSION = re.search(
+        r"^VERSION = '([^']+)'", init_file.read(), re.MULTILINE
+    ).group(1)
+
 tests_require = [
     'Flask'
 ]
@@ -23,7 +30,7 @@ install_requires = [
 
 setup(
     name='empowering',
-    version='0.15.3',
+    version=VERSION,
     author='GISCE-TI, S.L.',
     author_email='devel@gisce.net',
     url='http://code.gisce.net/empowering',
@@ -37,6 +44,12 @@ setup(
     extras_require={'test': tests_require},
     test_suite='nose.collector',
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'empowering-export = empowering.cli:export_main',
+            'empowering-sync = empowering.sync:main',
+        ],
+    },
     classifiers=[
         'Intended Audience :: Developers',
         'Operating System :: OS Independent',
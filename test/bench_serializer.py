@@ -0,0 +1,110 @@
+"""Micro-benchmark of the Contract serialization.
+
+Compares the serialization as it was before, a new models.Contract() schema
+per call pruned by the original remove_none, against the shared schema of
+models.dump, checking that both produce exactly the same JSON, key order
+included.
+
+    python test/bench_serializer.py [iterations]
+"""
+import json
+import sys
+import timeit
+from datetime import datetime
+
+from empowering import models
+
+
+def make_contract(i):
+    return {
+        'payerId': 'c1759810-90f3-012e-0404-34159e211070',
+        'ownerId': 'c1759810-90f3-012e-0404-34159e211070',
+        'signerId': None,
+        'power': 3300 + i,
+        'dateStart': datetime(2013, 10, 11, 16, 37, 5),
+        'dateEnd': None,
+        'contractId': 'contractID-%d' % i,
+        'tariffId': '2.0A',
+        'version': 1,
+        'activityCode': '9820',
+        'meteringPointId': 'c1759810-90f3-012e-0404-34159e211070',
+        'experimentalGroupUser': False,
+        'activeUser': True,
+        'customer': {
+            'customerId': 'c1759810-90f3-012e-0404-34159e211070',
+            'address': {
+                'city': 'city-%d' % i,
+                'cityCode': None,
+                'countryCode': 'ES',
+                'country': 'Spain',
+                'street': 'street-%d' % i,
+                'postalCode': '17001',
+            },
+            'buildingData': {
+                'dwellingArea': 80,
+                'buildingType': 'Apartment',
+            },
+            'profile': {
+                'totalPersonNumber': 3,
+                'educationLevel': {'edu_prim': 1, 'edu_uni': None},
+            },
+        },
+        'devices': [{
+            'dateStart': '2013-10-11T16:37:05Z',
+            'dateEnd': None,
+            'deviceId': 'c1810810-0381-012d-25a8-0017f2cd3574',
+        }],
+        'powerHistory': [{
+            'dateStart': '2013-10-11T16:37:05Z',
+            'dateEnd': None,
+            'power': 3300,
+        }],
+        'report': {'language': 'ca_ES', 'initialMonth': 201501},
+    }
+
+
+def baseline_remove_none(struct):
+    # Frozen copy of the post_dump of the first models.py
+    converted = struct.copy()
+    for key, value in struct.items():
+        if isinstance(value, dict):
+            converted[key] = baseline_remove_none(value)
+        else:
+            if (value is None or (isinstance(value, bool) and not value)):
+                del converted[key]
+    return converted
+
+
+def per_call(obj):
+    prune = models.prune
+    models.prune = baseline_remove_none
+    try:
+        return models.Contract().dump(obj).data
+    finally:
+        models.prune = prune
+
+
+def shared(obj):
+    return models.dump(models.Contract, obj)
+
+
+def main(iterations=2000):
+    contracts = [make_contract(i) for i in range(100)]
+    for contract in contracts:
+        if json.dumps(shared(contract)) != json.dumps(per_call(contract)):
+            raise AssertionError('Outputs differ for %s'
+                                 % contract['contractId'])
+
+    results = {}
+    for name, serialize in (('per_call', per_call), ('shared', shared)):
+        timer = timeit.Timer(
+            lambda: [serialize(c) for c in contracts]
+        )
+        best = min(timer.repeat(3, max(1, iterations // len(contracts))))
+        results[name] = iterations / best
+        print '%-10s %10.1f contracts/s' % (name, results[name])
+    print 'speedup    %10.2fx' % (results['shared'] / results['per_call'])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
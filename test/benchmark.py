@@ -0,0 +1,250 @@
+"""Benchmarks of the library against the local fake backend.
+
+Measures multiget pages/s, Contracts.wrap_object serializations/s and bulk
+create items/s at every concurrency level, and writes the results as JSON so
+runs can be compared over time.
+
+Every benchmark runs in its own process, so its peak memory is its own and
+not the peak of the ones before. The backend is served over HTTPS with a
+certificate generated on the fly unless one is given, as the connections
+are only kept alive over HTTPS; with --plain-http every request opens a new
+connection.
+
+    python test/benchmark.py [--concurrency 1,2,4,8] [--latency 0.01]
+                             [--output benchmark.json] ...
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+from bench_serializer import make_contract
+from fake_backend import FakeBackend
+
+from empowering import Empowering, VERSION
+from empowering.executors.pool import default_pool
+
+
+def peak_memory():
+    """Peak resident memory of the process, in KiB.
+
+    It is the peak of the whole life of the process, see `run_benchmark`.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def timed(function, repeat):
+    """Best time of `repeat` calls of function.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_multiget(client, args, workers):
+    pages = -(-args.total // args.page_size)
+
+    def run():
+        result = client.ot101_results().multiget(
+            max_results=args.page_size, workers=workers
+        )
+        if len(result['_items']) != args.total:
+            raise AssertionError('Got %d items' % len(result['_items']))
+
+    elapsed = timed(run, args.repeat)
+    return {'pages': pages, 'seconds': elapsed, 'rate': pages / elapsed,
+            'unit': 'pages/s'}
+
+
+def bench_serialize(client, args, workers):
+    contracts = [make_contract(i) for i in range(args.contracts)]
+    wrap_object = client.contracts().wrap_object
+    thread_pool = ThreadPool(workers)
+
+    def run():
+        thread_pool.map(wrap_object, contracts, chunksize=args.chunk_size)
+
+    try:
+        elapsed = timed(run, args.repeat)
+    finally:
+        thread_pool.close()
+        thread_pool.join()
+    return {'items': len(contracts), 'seconds': elapsed,
+            'rate': len(contracts) / elapsed, 'unit': 'contracts/s'}
+
+
+def bench_bulk_create(client, args, workers):
+    contracts = [make_contract(i) for i in range(args.contracts)]
+    errors = []
+
+    def run():
+        results = client.contracts().create_many(
+            contracts, chunk_size=args.chunk_size, workers=workers
+        )
+        errors.append(sum(1 for r in results if r.get('_status') != 'OK'))
+
+    elapsed = timed(run, args.repeat)
+    return {'items': len(contracts), 'seconds': elapsed,
+            'rate': len(contracts) / elapsed, 'unit': 'contracts/s',
+            'errors': max(errors)}
+
+
+BENCHMARKS = (
+    ('multiget', bench_multiget),
+    ('serialize', bench_serialize),
+    ('bulk_create', bench_bulk_create),
+)
+
+
+def run_benchmark(argv, name, workers, url):
+    """Run a benchmark in a new process and return its result.
+
+    The peak memory reported by the process is then the one of the
+    benchmark, and `memory_delta_kib` what it grew over the setup.
+    """
+    command = [sys.executable, os.path.abspath(__file__)] + argv + [
+        '--run', name, '--workers', str(workers), '--apiroot', url
+    ]
+    output = subprocess.check_output(command)
+    return json.loads(output.splitlines()[-1])
+
+
+def run_child(args):
+    client = Empowering(1, apiroot=args.apiroot, backoff=0.01,
+                        compress_threshold=args.compress_threshold)
+    benchmark = dict(BENCHMARKS)[args.run]
+    before = peak_memory()
+    try:
+        result = benchmark(client, args, args.workers)
+    finally:
+        default_pool.clear()
+    result['peak_memory_kib'] = peak_memory()
+    result['memory_delta_kib'] = result['peak_memory_kib'] - before
+    print json.dumps(result)
+
+
+def make_certificate(directory):
+    """Generate a self-signed certificate for 127.0.0.1 with openssl.
+    """
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+            '-days', '1', '-subj', '/CN=127.0.0.1', '-keyout', keyfile,
+            '-out', certfile
+        ], stdout=devnull, stderr=devnull)
+    return certfile, keyfile
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', default='1,2,4,8',
+                        help='Comma separated numbers of workers')
+    parser.add_argument('--total', type=int, default=2000,
+                        help='Items of the collections')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--contracts', type=int, default=1000,
+                        help='Contracts to serialize and create')
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Seconds the backend takes per request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests answered with 503')
+    parser.add_argument('--payload-size', type=int, default=200,
+                        help='Bytes of padding of every item')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='Comma separated benchmarks to run')
+    parser.add_argument('--certfile',
+                        help='Certificate of the backend, generated with '
+                             'openssl by default')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--plain-http', action='store_true',
+                        help='Serve over HTTP, without keep-alive')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Gzip the responses')
+    parser.add_argument('--compress-threshold', type=int,
+                        help='Gzip the request bodies of this size or more')
+    parser.add_argument('--output', default='benchmark.json')
+    # Set by `run_benchmark` for the benchmark processes
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--workers', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--apiroot', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parse_args(argv)
+    if args.run:
+        return run_child(args)
+    concurrency = [int(c) for c in args.concurrency.split(',')]
+    only = args.only and args.only.split(',')
+    certfile, keyfile = args.certfile, args.keyfile
+    cert_directory = None
+    if args.plain_http:
+        certfile = keyfile = None
+    elif not certfile:
+        cert_directory = tempfile.mkdtemp()
+        certfile, keyfile = make_certificate(cert_directory)
+    backend = FakeBackend(
+        total=args.total, page_size=args.page_size, latency=args.latency,
+        error_rate=args.error_rate, payload_size=args.payload_size,
+        seed=args.seed, certfile=certfile, keyfile=keyfile, gzip=args.gzip
+    ).start()
+    keep_alive = backend.scheme == 'https'
+    print 'Backend at %s, keep-alive %s' % (backend.url,
+                                             'on' if keep_alive else 'off')
+
+    results = []
+    try:
+        for name, benchmark in BENCHMARKS:
+            if only and name not in only:
+                continue
+            for workers in concurrency:
+                result = run_benchmark(argv, name, workers, backend.url)
+                result.update({'benchmark': name, 'workers': workers})
+                results.append(result)
+                print '%-12s workers=%-3d %10.1f %s %8d KiB peak' % (
+                    name, workers, result['rate'], result['unit'],
+                    result['peak_memory_kib']
+                )
+    finally:
+        backend.stop()
+        if cert_directory:
+            shutil.rmtree(cert_directory)
+
+    report = {
+        'version': VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': vars(args),
+        'keep_alive': keep_alive,
+        'backend': backend.counters,
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print 'Results written to %s' % args.output
+
+
+if __name__ == '__main__':
+    main()
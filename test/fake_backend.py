@@ -0,0 +1,240 @@
+"""Local stand-in for the Empowering (Eve) API, for benchmarks.
+
+Collections answer paginated `_items` with `_links.next` and `_meta`,
+responses have ETags and are answered with 304 to `If-None-Match`, POSTs
+accept single and bulk inserts and /authn/login hands out tokens. Latency,
+error rate and payload size are configurable and the errors are drawn from
+a seeded generator, so runs are reproducible.
+
+    python test/fake_backend.py [--port 5000] [--latency 0.01] ...
+"""
+import argparse
+import json
+import random
+import socket
+import ssl
+import threading
+import time
+import urlparse
+import zlib
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from hashlib import sha1
+
+UPDATED = 'Tue, 01 Jan 2013 00:00:00 GMT'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer the responses so they aren't sent a header at a time
+    wbufsize = -1
+
+    def setup(self):
+        # Like real servers, don't wait for ACKs to send the last segment
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        BaseHTTPRequestHandler.setup(self)
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body, headers=()):
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        accepted = self.headers.get('Accept-Encoding', '')
+        if self.server.backend.gzip and 'gzip' in accepted:
+            compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+            self.server.backend.count('gzipped')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def fail(self):
+        backend = self.server.backend
+        backend.count('requests')
+        if backend.latency:
+            time.sleep(backend.latency)
+        if backend.error_rate and backend.random() < backend.error_rate:
+            backend.count('errors')
+            self.send(503, json.dumps({'_status': 'ERR'}),
+                      [('Retry-After', '0')])
+            return True
+        return False
+
+    def do_GET(self):
+        if self.fail():
+            return
+        backend = self.server.backend
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        max_results = int(query.get('max_results', [backend.page_size])[0])
+        page = int(query.get('page', ['1'])[0])
+        body = backend.page(url.path, page, max_results)
+        etag = '"{0}"'.format(sha1(body).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            backend.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send(200, body, [('ETag', etag)])
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.fail():
+            return
+        backend = self.server.backend
+        if self.path.endswith('/authn/login'):
+            backend.count('logins')
+            token = 'token-{0}'.format(backend.counters['logins'])
+            return self.send(200, json.dumps({'success': True,
+                                              'token': token}))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        obj = json.loads(data)
+        if isinstance(obj, list) and len(obj) == 1:
+            # Like Eve, bulk inserts of one document answer the document
+            obj = obj[0]
+        if isinstance(obj, list):
+            backend.count('created', len(obj))
+            result = {'_status': 'OK', '_items': [
+                backend.created(item) for item in obj
+            ]}
+        else:
+            backend.count('created')
+            result = backend.created(obj)
+        self.send(201, json.dumps(result))
+
+    do_PATCH = do_PUT = do_POST
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping kept alive connections are not worth a traceback
+        pass
+
+
+class FakeBackend(object):
+    """Serve `total` items per collection in pages of `page_size`.
+
+    Every item carries `payload_size` bytes of padding. With `gzip` the
+    responses are compressed when the client accepts it.
+    """
+    def __init__(self, host='127.0.0.1', port=0, total=1000, page_size=100,
+                 latency=0.0, error_rate=0.0, payload_size=0, seed=0,
+                 certfile=None, keyfile=None, gzip=False):
+        self.total = total
+        self.page_size = page_size
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payload = 'x' * payload_size
+        self.gzip = gzip
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(
+            ('requests', 'errors', 'not_modified', 'logins', 'created',
+             'gzipped'), 0
+        )
+        self.server = Server((host, port), Handler)
+        self.server.backend = self
+        self.scheme = 'http'
+        if certfile:
+            self.scheme = 'https'
+            self.server.socket = ssl.wrap_socket(
+                self.server.socket, keyfile=keyfile, certfile=certfile,
+                server_side=True
+            )
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return '{0}://{1}:{2}'.format(self.scheme, host, port)
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def item(self, n):
+        return {
+            '_id': '{0:024x}'.format(n),
+            '_etag': sha1(str(n)).hexdigest(),
+            '_updated': UPDATED,
+            '_created': UPDATED,
+            'contractId': str(n),
+            'companyId': 1,
+            'month': 201501,
+            'value': n * 0.5,
+            'payload': self.payload,
+        }
+
+    def page(self, path, page, max_results):
+        first = (page - 1) * max_results
+        last = min(page * max_results, self.total)
+        links = {}
+        if last < self.total:
+            links['next'] = {'href': '{0}?max_results={1}&page={2}'.format(
+                path.lstrip('/'), max_results, page + 1
+            )}
+        return json.dumps({
+            '_items': [self.item(n) for n in xrange(first, last)],
+            '_links': links,
+            '_meta': {'total': self.total, 'max_results': max_results,
+                      'page': page},
+        })
+
+    def created(self, obj):
+        return {'_status': 'OK', '_updated': UPDATED,
+                '_etag': sha1(json.dumps(obj, sort_keys=True)).hexdigest(),
+                '_id': '{0:024x}'.format(self.rng.getrandbits(64))}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--total', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--payload-size', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+    backend = FakeBackend(
+        args.host, args.port, args.total, args.page_size, args.latency,
+        args.error_rate, args.payload_size, args.seed, args.certfile,
+        args.keyfile, args.gzip
+    )
+    print 'Serving on %s' % backend.url
+    try:
+        backend.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import unittest
+
+from empowering import Empowering
+from empowering.executors.pool import default_pool
+from fake_backend import FakeBackend
+
+
+class GzipTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend(total=250, gzip=True, payload_size=100)
+        self.backend.start()
+        self.client = Empowering(1, apiroot=self.backend.url,
+                                 compress_threshold=1)
+
+    def tearDown(self):
+        default_pool.clear()
+        self.backend.stop()
+
+    def test_get_receives_gzipped_responses(self):
+        result = self.client.ot101_results().multiget()
+        self.assertEqual(len(result['_items']), 250)
+        self.assertEqual(result['_items'][0]['contractId'], '0')
+        self.assertEqual(self.backend.counters['gzipped'],
+                         self.backend.counters['requests'])
+
+    def test_post_bodies_are_gzipped(self):
+        result = self.client.contracts().create_bulk([{'contractId': '1'},
+                                                      {'contractId': '2'}])
+        self.assertEqual(len(result['_items']), 2)
+        self.assertEqual(self.backend.counters['created'], 2)
@@ -0,0 +1,73 @@
+import httplib
+import unittest
+
+from empowering.resource import EmpoweringResource, bulk_results, page_count
+
+
+class BulkResultsTest(unittest.TestCase):
+    def test_items(self):
+        response = {'_status': 'OK', '_items': [
+            {'_status': 'OK', '_etag': 'a'}, {'_status': 'OK', '_etag': 'b'}
+        ]}
+        self.assertEqual(bulk_results(response, 2), response['_items'])
+
+    def test_single_document(self):
+        response = {'_status': 'OK', '_id': 'x', '_etag': 'abc'}
+        self.assertEqual(bulk_results(response, 1), [response])
+
+    def test_single_document_issues(self):
+        response = {'_status': 'ERR', '_issues': {'contractId': 'required'}}
+        self.assertEqual(bulk_results(response, 1), [response])
+
+    def test_rejected_batch(self):
+        issue = {'_status': 'ERR', '_issues': {'contractId': 'required'}}
+        response = {'_status': 'ERR', '_items': [{'_status': 'OK'}, issue]}
+        self.assertEqual(bulk_results(response, 2), [
+            {'_status': 'ERR', '_error': 'Batch rejected'}, issue
+        ])
+
+    def test_error_without_items(self):
+        response = {'_status': 'ERR', '_error': {'code': 500}}
+        self.assertEqual(bulk_results(response, 2), [
+            {'_status': 'ERR', '_error': {'code': 500}}
+        ] * 2)
+
+    def test_unexpected_number_of_results(self):
+        response = {'_status': 'OK', '_items': [{'_status': 'OK',
+                                                 '_etag': 'a'}]}
+        results = bulk_results(response, 2)
+        self.assertEqual([r['_status'] for r in results], ['ERR', 'ERR'])
+
+
+class FailingResource(EmpoweringResource):
+    path = 'contracts'
+
+    def __init__(self):
+        EmpoweringResource.__init__(self, None)
+
+    def create_bulk(self, objs):
+        if 'fail' in objs:
+            raise httplib.BadStatusLine('')
+        return [{'_status': 'OK', '_etag': obj} for obj in objs]
+
+
+class CreateManyTest(unittest.TestCase):
+    def test_failed_chunk_does_not_abort(self):
+        results = FailingResource().create_many(['a', 'fail', 'b'],
+                                                chunk_size=1, workers=1)
+        self.assertEqual([r['_status'] for r in results], ['OK', 'ERR', 'OK'])
+        self.assertTrue(results[1]['_error'].startswith('BadStatusLine'))
+
+
+class PageCountTest(unittest.TestCase):
+    def test_page_count(self):
+        self.assertEqual(page_count({'_meta': {'total': 250,
+                                               'max_results': 100}}), 3)
+        self.assertEqual(page_count({'_meta': {'total': 200,
+                                               'max_results': 100}}), 2)
+
+    def test_unknown(self):
+        self.assertEqual(page_count({}), None)
+        self.assertEqual(page_count({'_meta': None}), None)
+        self.assertEqual(page_count({'_meta': {'total': 0,
+                                               'max_results': 100}}), None)
@@ -0,0 +1,27 @@
+import argparse
+import unittest
+
+from empowering.sync import make_tasks, month_range, read_contracts
+
+
+class SyncTest(unittest.TestCase):
+    def test_month_range(self):
+        self.assertEqual(month_range(201511, 201602),
+                         [201511, 201512, 201601, 201602])
+        self.assertEqual(month_range(201502, 201501), [])
+
+    def test_read_contracts(self):
+        args = argparse.Namespace(contracts='3, 1,3,,2', contracts_file=None)
+        self.assertEqual(read_contracts(args), ['3', '1', '2'])
+
+    def test_task_files_depend_on_the_batches(self):
+        contracts = ['1', '2', '3', '4']
+        tasks = make_tasks('out', ['ot101'], [201501], contracts, 2)
+        same = make_tasks('out', ['ot101'], [201501], contracts, 2)
+        other = make_tasks('out', ['ot101'], [201501], contracts, 3)
+        self.assertEqual([t.path for t in tasks], [t.path for t in same])
+        self.assertEqual([t.contracts for t in tasks], [['1', '2'],
+                                                        ['3', '4']])
+        self.assertFalse(set(t.path for t in tasks) &
+                         set(t.path for t in other))
+        self.assertTrue(tasks[0].path.startswith('out/ot101/201501/00000-'))
@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from empowering.utils import (
+    UUIDIndex, atomic_write, make_uuid, make_uuids, normalize, remove_none,
+    null_to_none, false_to_none, none_to_false, searchparams_to_querystring,
+    make_utc_timestamp, make_utc_timestamps, make_local_timestamp,
+    make_local_timestamps, datestring_to_epoch, datestrings_to_epoch
+)
+
+
+class UUIDTest(unittest.TestCase):
+    def test_equal_ids_of_other_types(self):
+        one = make_uuid('contract', 1)
+        self.assertNotEqual(make_uuid('contract', True), one)
+        self.assertEqual(make_uuid('contract', 1), one)
+        self.assertEqual(make_uuid(u'contract', u'1'), make_uuid('contract',
+                                                                 '1'))
+
+    def test_make_uuids_of_an_iterator(self):
+        index = UUIDIndex()
+        uuids = make_uuids('contract', (i for i in range(5)), index=index)
+        self.assertEqual(len(uuids), 5)
+        self.assertEqual(len(index), 5)
+        self.assertEqual(index[uuids[3]], ('contract', 3))
+
+    def test_index_update_with_an_iterator(self):
+        index = UUIDIndex()
+        index.update('contract', iter(['a', 'b']))
+        self.assertEqual(index[make_uuid('contract', 'b')], ('contract', 'b'))
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_rules_descend_through_lists(self):
+        struct = {'a': None, 'b': [{'c': None, 'd': 1}, ({'e': False}, )]}
+        self.assertEqual(normalize(struct, ('remove_none', 'remove_false')),
+                         {'b': [{'d': 1}, ({}, )]})
+        self.assertEqual(struct['b'][0], {'c': None, 'd': 1})
+
+    def test_unchanged_branches_are_shared(self):
+        struct = {'a': {'b': 1}, 'c': [{'d': None}]}
+        result = normalize(struct, ('remove_none', ))
+        self.assertIs(result['a'], struct['a'])
+        self.assertIsNot(result['c'], struct['c'])
+        unchanged = {'a': 1}
+        self.assertIs(normalize(unchanged, ('remove_none', )), unchanged)
+
+    def test_inplace(self):
+        struct = {'a': None, 'b': [{'c': None}]}
+        result = normalize(struct, ('remove_none', ), inplace=True)
+        self.assertIs(result, struct)
+        self.assertEqual(struct, {'b': [{}]})
+
+    def test_tuples_as_lists(self):
+        self.assertEqual(normalize(({'a': 1}, ), (), tuples_as_lists=True),
+                         [{'a': 1}])
+        self.assertEqual(normalize(({'a': 1}, ), ()), ({'a': 1}, ))
+
+    def test_functions_return_a_copy(self):
+        struct = {'a': 1, 'b': [1, 2]}
+        for func in (remove_none, null_to_none, false_to_none,
+                     none_to_false):
+            result = func(struct)
+            self.assertEqual(result, struct)
+            self.assertIsNot(result, struct)
+        items = [{'a': 1}]
+        self.assertIsNot(remove_none(items), items)
+
+    def test_functions(self):
+        struct = {'a': None, 'b': False, 'c': '', 'd': [{'e': None}]}
+        self.assertEqual(remove_none(struct), {'c': '', 'd': [{}]})
+        self.assertEqual(null_to_none(struct),
+                         {'a': None, 'b': False, 'c': None,
+                          'd': [{'e': None}]})
+        self.assertEqual(false_to_none(struct),
+                         {'a': None, 'b': None, 'c': '', 'd': [{'e': None}]})
+        self.assertEqual(none_to_false(struct),
+                         {'a': False, 'b': False, 'c': '',
+                          'd': [{'e': False}]})
+        self.assertIs(remove_none(struct, {'xmlrpc': True}), struct)
+
+
+class SearchParamsTest(unittest.TestCase):
+    def test_operators(self):
+        self.assertEqual(
+            searchparams_to_querystring([('a', '=', 1), ('b', '>', 2)]),
+            '"a"==1 and "b">2'
+        )
+
+    def test_in(self):
+        self.assertEqual(searchparams_to_querystring([('a', 'in', [1, 2])]),
+                         '("a"==1 or "a"==2)')
+        self.assertRaises(Exception, searchparams_to_querystring,
+                          [('a', 'in', [])])
+
+    def test_or(self):
+        self.assertEqual(
+            searchparams_to_querystring([
+                ('a', '=', 1), ('or', [('b', '=', 1), ('c', '>', 2)])
+            ]),
+            '"a"==1 and ("b"==1 or "c">2)'
+        )
+        self.assertRaises(Exception, searchparams_to_querystring,
+                          [('xor', [('a', '=', 1)])])
+
+
+class TimestampsTest(unittest.TestCase):
+    local = ['2015-01-15 12:30:00', '2015-03-29 03:30:00',
+             '2015-10-25 02:30:00', '2015-07-01T00:00:00',
+             datetime(2015, 10, 25, 1, 0), None, '']
+    universal = ['2015-01-15T11:30:00Z', '2015-03-29T01:30:00Z',
+                 '2015-10-25 01:30:00', datetime(2015, 6, 30, 22, 0),
+                 None, '']
+
+    def test_make_utc_timestamps(self):
+        self.assertEqual(make_utc_timestamps(self.local),
+                         [make_utc_timestamp(timestamp)
+                          for timestamp in self.local])
+
+    def test_make_utc_timestamps_epoch(self):
+        self.assertEqual(make_utc_timestamps(['2015-01-01 01:00:00', None],
+                                             epoch=True),
+                         [1420070400, None])
+
+    def test_make_local_timestamps(self):
+        self.assertEqual(make_local_timestamps(self.universal),
+                         [make_local_timestamp(timestamp)
+                          for timestamp in self.universal])
+
+    def test_datestrings_to_epoch(self):
+        dates = ['2015-01-01', '2015-06-01', '2015-01-01',
+                 datetime(2015, 3, 1), None]
+        self.assertEqual(datestrings_to_epoch(dates),
+                         [datestring_to_epoch(date) for date in dates])
+
+
+class AtomicWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replaces_the_file(self):
+        with open(self.path, 'w') as state_file:
+            state_file.write('old')
+        with atomic_write(self.path) as state_file:
+            state_file.write('new')
+            with open(self.path) as current:
+                self.assertEqual(current.read(), 'old')
+        with open(self.path) as current:
+            self.assertEqual(current.read(), 'new')
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+
+    def test_failed_writes_leave_no_files(self):
+        try:
+            with atomic_write(self.path) as state_file:
+                state_file.write('half')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(os.listdir(self.directory), [])